@@ -0,0 +1,17 @@
+'''
+This is a system for detecting the presence of people in the room.
+
+The system receives data from a video camera (local or IP), looks for people on the image and sends the search result (found or not) to the server via MQTT.
+Implemented support for the "MQTT Discovery" module for Home Assistant.
+
+Start: python -m presence_detect [arguments], settings are described in config.py.
+Importing the package is cheap: OpenCV, the network and paho-mqtt are loaded by the modules that need them.
+
+Email: gofk2005@yandex.ru
+Youtube channel: https://www.youtube.com/channel/UCUh89-ti4wwvwrm8nCZkz8Q
+Video review: https://youtu.be/WYWG3oeO04M
+Source: https://github.com/gofk2005/python/tree/master/people_detect
+Docker image: https://hub.docker.com/repository/docker/gofk/presence_detect
+'''
+
+VERSION = '1.1.0'
@@ -0,0 +1,6 @@
+''' Entry point: python -m presence_detect '''
+
+from .pipeline import main
+
+
+main()
@@ -0,0 +1,222 @@
+'''
+Offline benchmark of the presence detection pipeline.
+
+Recorded frames (directory of images or video file) are passed through the same functions as in the live loop:
+get_image -> image_processing -> person_is_found -> send_data (+ save_image with --save_images).
+The camera is replaced by capture.FileSource, the MQTT brocker by the local stand-in (fake_broker.py).
+
+Every combination of backend, model and confidence is run in a separate process, so startup time and peak memory are measured honestly.
+Results (frames/sec, p50/p95/p99 latency of every stage, peak RSS, startup time) are printed and written to a JSON file,
+the fastest configuration of the host is shown at the end.
+
+Example:
+    python -m presence_detect.benchmark --frames /data/recorded --backends opencv onnx --onnx_model yolov8n.onnx --models yolov4 yolov4-tiny --confidences 50 65 --output result.json
+'''
+
+import time
+STARTED = time.perf_counter()   # before heavy imports, for the startup time
+
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+from argparse import SUPPRESS, ArgumentParser
+from datetime import datetime
+
+
+BENCHMARK_SOURCE = 'benchmark'
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))   # the child processes import the package from here
+
+
+def percentile(values, p):
+    ''' Percentile with linear interpolation (values must be sorted) '''
+    if not values:
+        return None
+    position = (len(values) - 1) * p / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def stage_stats(durations):
+    values = sorted(durations)
+    return {
+        'count': len(values),
+        'avg_ms': round(sum(values) / len(values) * 1000, 2),
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_one(args):
+    ''' Run the pipeline for one configuration in the current process, returns the result dict '''
+    import_started = time.perf_counter()
+    from . import capture, fake_broker, metrics, pipeline, roi, snapshots
+    import_s = time.perf_counter() - import_started
+
+    metrics.record_samples()
+    broker = fake_broker.FakeBroker().start()
+    brocker = ('127.0.0.1', broker.port)
+    device = pipeline.device_info('benchmark')
+    confidence = args.confidence / 100
+    model = pipeline.load_detector(args.backend, args.model, args.gpu, args.model_input_size, args.threads)
+    load_s = time.perf_counter() - import_started - import_s
+
+    source = capture.FileSource(args.frames)
+    capture.register_source(BENCHMARK_SOURCE, source)
+    # a fixed-shape ONNX model overrides model_input_size (see detector.OnnxDetector)
+    preprocessor = roi.Preprocessor(args.roi, args.input_size or model.input_size)
+    if not preprocessor.active:
+        preprocessor = None
+    if args.save_images:
+        pipeline.snapshot_writer = snapshots.SnapshotWriter(tempfile.mkdtemp(prefix='presence_benchmark_'), log=lambda message: None)
+        pipeline.snapshot_writer.start()
+
+    previous_state = None
+    frames = 0
+    first_detection_s = None
+    frame_durations = []
+    loop_started = time.perf_counter()
+    while args.max_frames == 0 or frames < args.max_frames:
+        frame_started = time.perf_counter()
+        image = pipeline.get_image(BENCHMARK_SOURCE)
+        if image is None:
+            break
+        processed_image, transform = pipeline.image_processing(image, preprocessor)
+        found = pipeline.person_is_found(processed_image, model, confidence, image, transform)
+        if args.save_images:
+            pipeline.save_image(image, found, found != previous_state)
+        if found != previous_state:
+            pipeline.send_data(found, device, brocker, True)
+            previous_state = found
+        frames += 1
+        if first_detection_s is None:
+            # the first frame includes opening of the source, it is reported separately
+            first_detection_s = time.perf_counter() - STARTED
+            loop_started = time.perf_counter()
+        else:
+            frame_durations.append(time.perf_counter() - frame_started)
+    loop_s = time.perf_counter() - loop_started
+    if args.save_images:
+        pipeline.snapshot_writer.flush()
+
+    from . import publisher
+    publisher.stop_all()
+    broker.stop()
+
+    return {
+        'backend': args.backend,
+        'model': args.model,
+        'model_input_size': model.input_size,
+        'threads': args.threads,
+        'confidence': args.confidence,
+        'gpu': args.gpu,
+        'roi': args.roi,
+        'input_size': args.input_size or model.input_size,
+        'frames': frames,
+        'fps': round(len(frame_durations) / loop_s, 2) if frame_durations and loop_s > 0 else None,
+        'startup': {'import_s': round(import_s, 2), 'model_load_s': round(load_s, 2), 'first_detection_s': round(first_detection_s, 2) if first_detection_s else None},
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': dict({name: stage_stats(durations) for name, durations in metrics.samples().items()},
+                       frame=stage_stats(frame_durations) if frame_durations else None),
+        'detections': {'person': metrics.DETECTIONS.value(result='person'), 'nobody': metrics.DETECTIONS.value(result='nobody')},
+        'mqtt_messages_received': len(broker.messages),
+    }
+
+
+def run_all(args):
+    ''' Run every configuration in a child process and collect the results '''
+    runs = []
+    for backend in args.backends:
+        # the onnx backend has its own model file, the darknet models are used by the other backends
+        models = [os.path.abspath(args.onnx_model)] if backend == 'onnx' else args.models
+        if backend == 'onnx' and not args.onnx_model:
+            print('Skip onnx backend: --onnx_model is not specified')
+            continue
+        for model in models:
+            for confidence in args.confidences:
+                with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+                    result_file = f.name
+                command = [sys.executable, '-m', __package__ + '.benchmark', '--run_one', '--frames', os.path.abspath(args.frames),
+                           '--backend', backend, '--model', model, '--confidence', str(confidence), '--max_frames', str(args.max_frames),
+                           '--result_file', result_file, '--roi', args.roi, '--input_size', str(args.input_size),
+                           '--model_input_size', str(args.model_input_size), '--threads', str(args.threads)]
+                if args.gpu:
+                    command.append('--gpu')
+                if args.save_images:
+                    command.append('--save_images')
+                print('Run: backend=' + backend + ', model=' + os.path.basename(model) + ', confidence=' + str(confidence), flush=True)
+                completed = subprocess.run(command, stdout=None if args.verbose else subprocess.DEVNULL, cwd=PACKAGE_PARENT)
+                if completed.returncode == 0:
+                    with open(result_file) as f:
+                        result = json.load(f)
+                    runs.append(result)
+                    frame = result['stages'].get('frame') or {}
+                    print('  fps: ' + str(result['fps']) + ', p50/p95/p99: ' + str(frame.get('p50_ms')) + '/' + str(frame.get('p95_ms')) + '/' + str(frame.get('p99_ms')) +
+                          ' ms, startup: ' + str(result['startup']['first_detection_s']) + ' s, peak RSS: ' + str(result['peak_rss_mb']) + ' MB')
+                else:
+                    print('  failed, exit code ' + str(completed.returncode))
+                    runs.append({'backend': backend, 'model': model, 'confidence': confidence, 'error': completed.returncode})
+                os.remove(result_file)
+
+    finished = [run for run in runs if run.get('fps')]
+    fastest = max(finished, key=lambda run: run['fps']) if finished else None
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'frames_path': os.path.abspath(args.frames),
+        'runs': runs,
+        'fastest': {key: fastest[key] for key in ('backend', 'model', 'confidence', 'fps')} if fastest else None,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    if fastest:
+        print('Fastest: backend=' + fastest['backend'] + ', model=' + os.path.basename(fastest['model']) + ', confidence=' + str(fastest['confidence']) +
+              ', fps: ' + str(fastest['fps']))
+    print('Results: ' + args.output)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Offline benchmark of the presence detection pipeline')
+    parser.add_argument('--frames', type=str, required=True, help='Directory with recorded frames (jpg, png, bmp) or video file')
+    parser.add_argument('--backends', type=str, nargs='+', choices=('opencv', 'onnx', 'cvlib'), default=['opencv'], help='Inference backends to compare')
+    parser.add_argument('--models', type=str, nargs='+', default=['yolov4', 'yolov4-tiny'], help='Models to compare (opencv and cvlib backends)')
+    parser.add_argument('--onnx_model', type=str, default='', help='Model file for the onnx backend')
+    parser.add_argument('--model_input_size', type=int, default=416, help='Size of the network input, px')
+    parser.add_argument('--threads', type=int, default=0, help='Number of threads of the backend. 0 - library default')
+    parser.add_argument('--confidences', type=int, nargs='+', default=[65], help='Confidence values to compare, percent')
+    parser.add_argument('--max_frames', type=int, default=0, help='Process no more than this number of frames. 0 - all')
+    parser.add_argument('--roi', type=str, default='', help='Regions of interest, same as --roi of presence_detect')
+    parser.add_argument('--input_size', type=int, default=0, help='Letterbox size before the recognition, same as --input_size of presence_detect. 0 - model_input_size')
+    parser.add_argument('--gpu', action='store_true', help='Run on GPU')
+    parser.add_argument('--save_images', action='store_true', help='Save snapshots (to a temporary directory) as the live loop does')
+    parser.add_argument('--output', type=str, default='benchmark_' + datetime.now().strftime('%Y%m%d_%H%M%S') + '.json', help='JSON file for the results')
+    parser.add_argument('--verbose', action='store_true', help='Show the log of the pipeline')
+    # internal: run one configuration in this process
+    parser.add_argument('--run_one', action='store_true', help=SUPPRESS)
+    parser.add_argument('--backend', type=str, default='opencv', help=SUPPRESS)
+    parser.add_argument('--model', type=str, default='yolov4', help=SUPPRESS)
+    parser.add_argument('--confidence', type=int, default=65, help=SUPPRESS)
+    parser.add_argument('--result_file', type=str, default='', help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        result = run_one(args)
+        with open(args.result_file, 'w') as f:
+            json.dump(result, f)
+    else:
+        run_all(args)
@@ -0,0 +1,246 @@
+'''
+Background frame grabber for the presence detection system.
+
+Opening a camera (especially an RTSP stream from an IP-camera) takes much longer than reading a frame from it,
+and the first frame after connecting is often an old one from the decoder buffer.
+Therefore every video source is kept open on its own thread, which reads frames continuously and keeps only the newest one.
+The detection loop takes this frame when it needs it. A frame is handed out only once and only while it is fresh:
+after the stream dies the last frame is discarded, so the detection never runs on a frozen picture.
+'''
+
+import os
+import threading
+import time
+
+import cv2
+
+
+def current_monotonic_ms():
+    return time.monotonic() * 1000
+
+
+class FrameGrabber(threading.Thread):
+    ''' Keeps the video source open and always holds the newest decoded frame.
+
+    Keyword arguments:
+    source -- camera identifier (type: int) or video stream address (type: str);
+    reconnect_delay -- initial delay before reconnecting after a failure, sec;
+    reconnect_delay_max -- upper bound for the reconnect delay (the delay is doubled after each failed attempt), sec;
+    max_age -- frames received earlier than this are not handed out, sec;
+    '''
+
+    def __init__(self, source=0, reconnect_delay=1, reconnect_delay_max=30, max_age=5):
+        super().__init__(name='grabber-' + str(source), daemon=True)
+        self.source = source
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_delay_max = reconnect_delay_max
+        self.max_age_ms = max_age * 1000
+
+        self._stop_event = threading.Event()
+        self._new_frame = threading.Condition()
+        self._frame = None
+        self._frame_id = 0
+        self._frame_time = 0        # monotonic time (ms) when the last frame was received
+
+        self.frames_grabbed = 0
+        self.frames_dropped = 0     # real losses: failed reads (the stream has died)
+        self.frames_superseded = 0  # frames replaced by a newer one before anyone took them (normal between two checks)
+        self.reconnects = 0
+        self.last_read_ms = 0.0     # duration of the last cap.read() call
+        self.avg_read_ms = 0.0      # exponential moving average of cap.read() duration
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.source)
+        # Ask the backend to keep as few frames as possible, not every backend supports it
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        return cap
+
+    def run(self):
+        delay = self.reconnect_delay
+        cap = None
+        while not self._stop_event.is_set():
+            if cap is None:
+                cap = self._open()
+                if cap is None:
+                    self._stop_event.wait(delay)
+                    delay = min(delay * 2, self.reconnect_delay_max)
+                    self.reconnects += 1
+                    continue
+
+            started = current_monotonic_ms()
+            success, image = cap.read()
+            finished = current_monotonic_ms()
+
+            if not success or image is None:
+                # The stream is dead (camera rebooted, network problems, etc.) - reopen it with backoff
+                with self._new_frame:
+                    self._frame = None
+                self.frames_dropped += 1
+                cap.release()
+                cap = None
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, self.reconnect_delay_max)
+                self.reconnects += 1
+                continue
+
+            delay = self.reconnect_delay
+            self.last_read_ms = finished - started
+            self.avg_read_ms = self.last_read_ms if self.frames_grabbed == 0 else self.avg_read_ms * 0.9 + self.last_read_ms * 0.1
+
+            with self._new_frame:
+                if self._frame is not None:
+                    self.frames_superseded += 1
+                # cap.read() allocates a new array for every frame, so the frame can be handed out without copying
+                self._frame = image
+                self._frame_id += 1
+                self._frame_time = finished
+                self.frames_grabbed += 1
+                self._new_frame.notify_all()
+
+        if cap is not None:
+            cap.release()
+
+    def _fresh(self):
+        return self._frame is not None and current_monotonic_ms() - self._frame_time <= self.max_age_ms
+
+    def read(self, timeout=10):
+        ''' Return the newest frame that was not returned before and is not older than max_age
+        (or None if there is no such frame during timeout, sec).
+        The grabber gives the array away: it is not copied and the grabber keeps no reference to it, so the caller may draw on it.'''
+        with self._new_frame:
+            if not self._fresh():
+                self._new_frame.wait_for(lambda: self._fresh() or self._stop_event.is_set(), timeout)
+            if not self._fresh():
+                return None
+            image, self._frame = self._frame, None
+            return image
+
+    def frame_age_ms(self):
+        ''' How long ago the last frame was received from the camera, ms '''
+        if self._frame_id == 0:
+            return None
+        return current_monotonic_ms() - self._frame_time
+
+    def stats(self):
+        return {
+            'source': self.source,
+            'frames_grabbed': self.frames_grabbed,
+            'frames_dropped': self.frames_dropped,
+            'frames_superseded': self.frames_superseded,
+            'reconnects': self.reconnects,
+            'capture_latency_ms': round(self.last_read_ms, 1),
+            'capture_latency_avg_ms': round(self.avg_read_ms, 1),
+            'frame_age_ms': None if self._frame_id == 0 else round(self.frame_age_ms(), 1),
+        }
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        with self._new_frame:
+            self._new_frame.notify_all()
+        self.join(timeout)
+
+
+class FileSource:
+    ''' Frames from a directory of images or from a video file. Used instead of the camera for the offline benchmark.
+    Has the same read() / stats() / stop() interface as FrameGrabber, every read() returns the next frame (None at the end).
+
+    Keyword arguments:
+    path -- directory with images (read in the order of names) or video file;
+    '''
+
+    IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+    def __init__(self, path):
+        self.source = path
+        self._files = None
+        self._cap = None
+        if os.path.isdir(path):
+            self._files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(self.IMAGE_EXTENSIONS))
+        else:
+            self._cap = cv2.VideoCapture(path)
+        self._position = 0
+        self.frames_grabbed = 0
+        self.frames_dropped = 0
+        self.frames_superseded = 0
+        self.last_read_ms = 0.0
+
+    def __len__(self):
+        if self._files is not None:
+            return len(self._files)
+        return int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def read(self, timeout=None):
+        started = current_monotonic_ms()
+        image = None
+        if self._files is not None:
+            while image is None and self._position < len(self._files):
+                image = cv2.imread(self._files[self._position])
+                self._position += 1
+        else:
+            success, image = self._cap.read()
+            if not success:
+                image = None
+        self.last_read_ms = current_monotonic_ms() - started
+        if image is not None:
+            self.frames_grabbed += 1
+        return image
+
+    def stats(self):
+        return {
+            'source': self.source,
+            'frames_grabbed': self.frames_grabbed,
+            'frames_dropped': 0,
+            'frames_superseded': 0,
+            'reconnects': 0,
+            'capture_latency_ms': round(self.last_read_ms, 1),
+            'capture_latency_avg_ms': round(self.last_read_ms, 1),
+            'frame_age_ms': 0.0,
+        }
+
+    def stop(self, timeout=None):
+        if self._cap is not None:
+            self._cap.release()
+
+
+_grabbers = {}
+_grabbers_lock = threading.Lock()
+
+
+def get_grabber(source=0):
+    ''' Return the running grabber for the source, start it on first use '''
+    with _grabbers_lock:
+        grabber = _grabbers.get(source)
+        if grabber is None:
+            grabber = FrameGrabber(source)
+            grabber.start()
+            _grabbers[source] = grabber
+        return grabber
+
+
+def register_source(source, grabber):
+    ''' Use the given object (e.g. FileSource) as the grabber of the source '''
+    with _grabbers_lock:
+        _grabbers[source] = grabber
+
+
+def frames_dropped():
+    ''' Total number of frames lost by the grabbers because of failed reads (all grabbers) '''
+    with _grabbers_lock:
+        return sum(grabber.frames_dropped for grabber in _grabbers.values())
+
+
+def frames_superseded():
+    ''' Total number of frames replaced by newer ones before the detection loop took them (all grabbers).
+    Normal operation: the camera gives more frames than the detection takes. '''
+    with _grabbers_lock:
+        return sum(grabber.frames_superseded for grabber in _grabbers.values())
+
+
+def stop_all():
+    with _grabbers_lock:
+        for grabber in _grabbers.values():
+            grabber.stop()
+        _grabbers.clear()
@@ -0,0 +1,175 @@
+'''
+Settings of the presence detection system.
+
+Every setting is described once in OPTIONS and can be given in three ways, a later source overrides an earlier one:
+    1. JSON file (path in --config_file or CONFIG_FILE), keys are the option names: {"period": 10, "motion_gate": true};
+    2. environment variables, the option name in upper case: PERIOD=10, MOTION_GATE=1 (used in the docker container);
+    3. command line arguments: --period 10 --motion_gate.
+Flags are switched on by "--name" and off by "--no_name", in the environment and in the file by 1/0 or true/false.
+'''
+
+import json
+import os
+import sys
+from argparse import ArgumentParser, Namespace
+
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+
+class Option:
+    ''' One setting.
+
+    Keyword arguments:
+    name -- option name (command line argument --name, environment variable NAME, key in the file);
+    type -- str, int, float or bool (flag);
+    default -- value if the option is not given anywhere;
+    help -- description for --help;
+    choices -- allowed values (None - any);
+    '''
+
+    def __init__(self, name, type, default, help, choices=None):
+        self.name = name
+        self.type = type
+        self.default = default
+        self.help = help
+        self.choices = choices
+
+    @property
+    def env(self):
+        return self.name.upper()
+
+    def parse(self, value):
+        ''' Convert the value from the environment (string) or from the file (JSON value), raises ValueError '''
+        if self.type is bool:
+            if isinstance(value, bool):
+                return value
+            if str(value).lower() in TRUE_VALUES:
+                return True
+            if str(value).lower() in FALSE_VALUES:
+                return False
+            raise ValueError(self.name + ': flag value expected (1/0, true/false), got ' + repr(value))
+        try:
+            value = self.type(value)
+        except (TypeError, ValueError):
+            raise ValueError(self.name + ': ' + self.type.__name__ + ' value expected, got ' + repr(value))
+        if self.choices is not None and value not in self.choices:
+            raise ValueError(self.name + ': ' + repr(value) + ' is not allowed')
+        return value
+
+
+OPTIONS = [
+    Option('source', str, '0', 'Camera ID (if a numeric value is specified) or video stream address from IP-camera (if a string is specified)'),
+    Option('cameras', str, '', 'Multi-camera mode: path to JSON file (or JSON string) with the list of cameras. All cameras share one detector. --source is ignored'),
+    Option('roi', str, '', 'Regions of interest: "x1,y1,x2,y2" rectangles and "poly:x1,y1,x2,y2,x3,y3,..." polygons separated by ";". Values up to 1 are fractions of the frame size. Only these regions are recognized'),
+    Option('input_size', int, 0, 'Reduce and letterbox the image to this size before the recognition, px. 0 - model_input_size, so the frame is resized only once'),
+    Option('period', int, 30, 'Camera snapshot period, sec'),
+    Option('adaptive_period', bool, False, 'Check the camera more often after the state change and less often when the room is empty for a long time'),
+    Option('min_period', int, 5, 'Camera snapshot period right after the state change (with --adaptive_period), sec'),
+    Option('max_period', int, 120, 'Maximum camera snapshot period when the room is empty (with --adaptive_period), sec'),
+    Option('boost_duration', int, 60, 'How long to use min_period after the state change (with --adaptive_period), sec'),
+    Option('idle_after', int, 600, 'The room should be empty for this time before the period starts to grow (with --adaptive_period), sec'),
+    Option('motion_gate', bool, False, 'Run the object recognition only if the scene has changed since the last recognition'),
+    Option('motion_threshold', float, 1.0, 'Percent of changed pixels starting from which the scene is considered changed (with --motion_gate)'),
+    Option('motion_max_interval', int, 300, 'Maximal time between full recognitions even if the scene is not changed (with --motion_gate), sec'),
+    Option('tracking', bool, False, 'After a person is found, confirm the presence on the next frames by searching the found boxes instead of the full recognition'),
+    Option('track_threshold', float, 0.6, 'Minimal correlation (0-1) of the tracked box to consider the person still present (with --tracking)'),
+    Option('revalidate_interval', int, 60, 'Maximal time without full recognition while tracking (with --tracking), sec'),
+    Option('enter_frames', int, 1, 'Number of positive results in a row to change the state to "present"'),
+    Option('leave_frames', int, 1, 'Number of negative results in a row to change the state to "absent"'),
+    Option('send_interval', int, 300, 'The period of regular sending of data to the server even if there are no changes, sec'),
+    Option('device_id', int, 0, 'Device ID'),
+    Option('use_mqtt', bool, True, 'Transfer data to MQTT brocker'),
+    Option('mqtt_brocker_ip', str, '127.0.0.1', 'IP address of MQTT brocker'),
+    Option('mqtt_brocker_port', int, 1883, 'Port of MQTT brocker'),
+    Option('mqtt_qos', int, 0, 'QoS level of MQTT messages: 0, 1 or 2', range(0, 3)),
+    Option('mqtt_retain', bool, False, 'Send the sensor state as retained MQTT message'),
+    Option('metrics_port', int, 0, 'Port of the HTTP endpoint with metrics in Prometheus format (http://<host>:<port>/metrics). 0 - disabled'),
+    Option('mqtt_diagnostics', bool, False, 'Register the diagnostics sensor in Home Assistant and send the metrics summary every send_interval'),
+    Option('save_images_to_disk', bool, True, 'Save images to HDD'),
+    # same values as snapshots.MODES, not imported here to keep the settings free of OpenCV
+    Option('snapshot_mode', str, 'all', 'Which images to save: all, changes (only when the state has changed) or person (only images with people)', ('all', 'changes', 'person')),
+    Option('jpeg_quality', int, 90, 'JPEG quality of the saved images, 1-100', range(1, 101)),
+    Option('snapshot_width', int, 0, 'Images wider than this are reduced before saving, px. 0 - original size'),
+    Option('img_max_size_mb', int, 0, 'Size budget of the img directory, the oldest days are deleted when it is exceeded, MB. 0 - no limit'),
+    Option('img_max_days', int, 0, 'Images older than this number of days are deleted. 0 - no limit'),
+    Option('backend', str, 'opencv', 'Inference backend: opencv (OpenCV DNN), onnx (ONNX Runtime, requires --onnx_model) or cvlib', ('opencv', 'onnx', 'cvlib')),
+    Option('yolo', str, 'yolov4', 'Model: yolov4 or yolov4-tiny (faster but less accurate), used by opencv and cvlib backends', ('yolov4', 'yolov4-tiny')),
+    Option('onnx_model', str, '', 'Path to YOLO model in ONNX format (YOLOv5 / YOLOv8 export), used by onnx backend'),
+    Option('model_input_size', int, 416, 'Size of the network input, px (multiple of 32). Smaller is faster but finds less small (distant) persons'),
+    Option('threads', int, 0, 'Number of threads of the inference backend. 0 - library default (all cores), with --workers - cores divided by workers'),
+    Option('workers', int, 0, 'Number of inference worker processes, capture and MQTT are not delayed by the recognition. 0 - recognition in the main process'),
+    Option('confidence', int, 65, 'Input a value between 1-99. This represents the percent confidence you require for a hit. Default is 65', range(1, 100)),
+    Option('use_gpu', bool, False, 'Attempt to run on GPU instead of CPU. Requires Open CV compiled with CUDA enables and Nvidia drivers set up correctly.'),
+]
+
+
+def build_parser():
+    ''' Command line arguments. Defaults are None, so only the arguments given explicitly override the other sources. '''
+    parser = ArgumentParser(prog='python -m presence_detect')
+    parser.add_argument('-v', '--version', action='store_true', help='Script version')
+    parser.add_argument('--config_file', type=str, default=None, help='JSON file with the settings (keys are the names of the arguments below)')
+    for option in OPTIONS:
+        if option.type is bool:
+            parser.add_argument('--' + option.name, dest=option.name, action='store_const', const=True, default=None, help=option.help)
+            parser.add_argument('--no_' + option.name, dest=option.name, action='store_const', const=False, default=None, help='Opposite of --' + option.name)
+        else:
+            parser.add_argument('--' + option.name, type=option.type, choices=option.choices, default=None, help=option.help)
+
+    # arguments of the previous versions of detect.py
+    parser.add_argument('--dont_use_mqtt', dest='use_mqtt', action='store_const', const=False, help='Same as --no_use_mqtt')
+    parser.add_argument('--dont_save_img_to_disk', dest='save_images_to_disk', action='store_const', const=False, help='Same as --no_save_images_to_disk')
+    parser.add_argument('--tiny_yolo', dest='yolo', action='store_const', const='yolov4-tiny', help='Same as --yolo yolov4-tiny')
+    parser.add_argument('--gpu', dest='use_gpu', action='store_const', const=True, help='Same as --use_gpu')
+    return parser
+
+
+def load(argv=None, environ=None, log=None):
+    ''' Collect the settings from the file, the environment and the command line.
+
+    Keyword arguments:
+    argv -- command line arguments (None - sys.argv);
+    environ -- environment variables (None - os.environ);
+    log -- function to report ignored values (None - print to stderr);
+    Returns argparse.Namespace with an attribute per option.
+    '''
+    environ = os.environ if environ is None else environ
+    log = log or (lambda message: print(message, file=sys.stderr))
+    args = build_parser().parse_args(argv)
+
+    values = {option.name: option.default for option in OPTIONS}
+    options = {option.name: option for option in OPTIONS}
+
+    config_file = args.config_file or environ.get('CONFIG_FILE')
+    if config_file:
+        with open(config_file) as f:
+            data = json.load(f)
+        for name, value in data.items():
+            if name not in options:
+                log('Config file ' + config_file + ': unknown option "' + name + '" is ignored')
+                continue
+            try:
+                values[name] = options[name].parse(value)
+            except ValueError as e:
+                log('Config file ' + config_file + ': ' + str(e) + ', ignored')
+
+    for option in OPTIONS:
+        value = environ.get(option.env)
+        if value is None or value == '':
+            continue
+        try:
+            values[option.name] = option.parse(value)
+        except ValueError as e:
+            log('Environment variable ' + option.env + ': ' + str(e) + ', ignored')
+
+    for option in OPTIONS:
+        value = getattr(args, option.name)
+        if value is not None:
+            values[option.name] = value
+
+    if not values['input_size']:
+        # letterbox straight to the network input, otherwise the backend stretches the frame to a square or resizes it a second time
+        values['input_size'] = values['model_input_size']
+
+    return Namespace(version=args.version, config_file=config_file, **values)
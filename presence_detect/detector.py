@@ -0,0 +1,257 @@
+'''
+Person detectors (inference backends).
+
+Every backend loads its network once per process and can process frames from several cameras in one call (batch).
+Only the selected classes ("person" by default) are kept, and they are filtered by confidence before the non-maximum suppression,
+so NMS runs on a handful of boxes instead of all candidates of 80 COCO classes.
+
+Backends (see create_detector()):
+    opencv -- YOLO darknet model via OpenCV DNN. Model files are the same as used by cvlib (~/.cvlib/object_detection/yolo/yolov3),
+              so already downloaded weights are reused;
+    onnx   -- YOLO model exported to ONNX (YOLOv5 / YOLOv8 output format) via ONNX Runtime, requires "pip install onnxruntime";
+    cvlib  -- cvlib.detect_common_objects() as in the previous versions, requires "pip install cvlib tensorflow".
+The libraries of the onnx and cvlib backends are imported only when the backend is loaded.
+'''
+
+import os
+import threading
+import urllib.request
+
+import cv2
+import numpy as np
+
+
+MODEL_DIR = os.path.join(os.path.expanduser('~'), '.cvlib', 'object_detection', 'yolo', 'yolov3')
+
+MODEL_URLS = {
+    'yolov4': ('https://github.com/AlexeyAB/darknet/raw/master/cfg/yolov4.cfg',
+               'https://github.com/AlexeyAB/darknet/releases/download/darknet_yolo_v3_optimal/yolov4.weights'),
+    'yolov4-tiny': ('https://github.com/AlexeyAB/darknet/raw/master/cfg/yolov4-tiny.cfg',
+                    'https://github.com/AlexeyAB/darknet/releases/download/darknet_yolo_v4_pre/yolov4-tiny.weights'),
+}
+
+PERSON_CLASS_ID = 0     # "person" is the first class of COCO
+NMS_THRESHOLD = 0.4
+
+
+def model_files(model='yolov4'):
+    ''' Return paths of cfg and weights files of the model, download them if necessary '''
+    files = []
+    for url in MODEL_URLS[model]:
+        path = os.path.join(MODEL_DIR, url.split('/')[-1])
+        if not os.path.exists(path):
+            os.makedirs(MODEL_DIR, exist_ok=True)
+            urllib.request.urlretrieve(url, path + '.part')
+            os.replace(path + '.part', path)
+        files.append(path)
+    return files
+
+
+def draw_bbox(img, bbox, conf, color=(0, 255, 0)):
+    ''' Draw detected persons on the image (in place) '''
+    for (x1, y1, x2, y2), c in zip(bbox, conf):
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(img, 'person ' + str(round(c * 100, 1)) + '%', (x1, max(y1 - 10, 0)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+    return img
+
+
+def select_boxes(boxes, scores, width, height, confidence, class_ids=(PERSON_CLASS_ID,)):
+    ''' Keep the boxes of the selected classes and run NMS on them.
+
+    Keyword arguments:
+    boxes -- array (N, 4): center x, center y, width, height as fractions of the image size;
+    scores -- array (N, number of classes): confidence of every class;
+    width, height -- size of the image, px;
+    confidence -- minimal confidence (0..1);
+    class_ids -- classes to keep, a box is kept if its best class is one of them;
+    Returns bbox (list of [x1, y1, x2, y2], px) and conf (list of float).
+    '''
+    best = scores.argmax(axis=1)
+    best_scores = scores[np.arange(len(scores)), best]
+    mask = np.isin(best, class_ids) & (best_scores >= confidence)
+    if not mask.any():
+        return [], []
+    boxes, best_scores = boxes[mask], best_scores[mask]
+
+    cx, cy, w, h = boxes[:, 0] * width, boxes[:, 1] * height, boxes[:, 2] * width, boxes[:, 3] * height
+    rects = np.stack([cx - w / 2, cy - h / 2, w, h], axis=1).astype(int)
+    bbox, conf = [], []
+    for index in np.array(cv2.dnn.NMSBoxes(rects.tolist(), best_scores.tolist(), confidence, NMS_THRESHOLD)).flatten():
+        x, y, w, h = rects[index].tolist()
+        bbox.append([max(x, 0), max(y, 0), min(x + w, width - 1), min(y + h, height - 1)])
+        conf.append(float(best_scores[index]))
+    return bbox, conf
+
+
+class Detector:
+    ''' Base class of the backends. The network is shared by all cameras of the process.
+
+    Keyword arguments:
+    model -- model name ('yolov4', 'yolov4-tiny') or path to the model file (onnx backend);
+    gpu -- run on GPU if the backend supports it;
+    input_size -- size of the network input, px (multiple of 32);
+    threads -- number of threads used by the backend (0 - library default);
+    class_ids -- COCO classes to detect (drawn and reported as "person");
+    '''
+
+    name = ''
+
+    def __init__(self, model='yolov4', gpu=False, input_size=416, threads=0, class_ids=(PERSON_CLASS_ID,)):
+        self.model = model
+        self.gpu = gpu
+        self.input_size = input_size
+        self.threads = threads
+        self.class_ids = tuple(class_ids)
+        self._lock = threading.Lock()
+
+    def load(self, warmup=True):
+        ''' Load the network. With warmup the first (slowest) pass is made on a blank image. '''
+        self._load()
+        if warmup:
+            # the first forward pass allocates all buffers and is much slower than the next ones
+            self.detect_batch([np.zeros((self.input_size, self.input_size, 3), np.uint8)], 1.0)
+        return self
+
+    def _load(self):
+        raise NotImplementedError
+
+    def detect(self, img, confidence=0.65):
+        return self.detect_batch([img], [confidence])[0]
+
+    def detect_batch(self, images, confidences=0.65):
+        ''' Detect persons on several images in one call.
+
+        Keyword arguments:
+        images -- list of BGR images (sizes may differ);
+        confidences -- minimal confidence, one value for all images or a list with a value per image;
+        Returns list of (bbox, conf) per image, bbox is a list of [x1, y1, x2, y2].
+        '''
+        if not isinstance(confidences, (list, tuple)):
+            confidences = [confidences] * len(images)
+        with self._lock:
+            return self._detect_batch(images, confidences)
+
+    def _detect_batch(self, images, confidences):
+        raise NotImplementedError
+
+
+class OpenCvDetector(Detector):
+    ''' YOLO darknet model via OpenCV DNN '''
+
+    name = 'opencv'
+
+    def _load(self):
+        cfg, weights = model_files(self.model)
+        if self.threads:
+            cv2.setNumThreads(self.threads)
+        self._net = cv2.dnn.readNetFromDarknet(cfg, weights)
+        if self.gpu:
+            self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+            self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+        self._output_names = self._net.getUnconnectedOutLayersNames()
+
+    def _detect_batch(self, images, confidences):
+        blob = cv2.dnn.blobFromImages(images, 1 / 255.0, (self.input_size, self.input_size), swapRB=True, crop=False)
+        self._net.setInput(blob)
+        outputs = self._net.forward(self._output_names)
+
+        # Depending on OpenCV version the output of a batch is either 3D (batch, rows, 85) or 2D (batch * rows, 85)
+        outputs = [out.reshape(len(images), -1, out.shape[-1]) for out in outputs]
+
+        results = []
+        for i, img in enumerate(images):
+            height, width = img.shape[:2]
+            rows = np.concatenate([out[i] for out in outputs])
+            # darknet output: box as fractions of the image, objectness, class scores (already multiplied by objectness)
+            results.append(select_boxes(rows[:, :4], rows[:, 5:], width, height, confidences[i], self.class_ids))
+        return results
+
+
+class OnnxDetector(Detector):
+    ''' YOLO model exported to ONNX, run by ONNX Runtime. Output formats:
+    YOLOv5 - (batch, rows, 85): box in input pixels, objectness, class scores;
+    YOLOv8 - (batch, 84, rows): box in input pixels, class scores.
+    '''
+
+    name = 'onnx'
+
+    def _load(self):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ['CPUExecutionProvider']
+        if self.gpu and 'CUDAExecutionProvider' in onnxruntime.get_available_providers():
+            providers.insert(0, 'CUDAExecutionProvider')
+        self._session = onnxruntime.InferenceSession(self.model, options, providers=providers)
+
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        # a model exported with the fixed shape dictates the batch and the input size
+        self._fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+        if isinstance(model_input.shape[2], int):
+            self.input_size = model_input.shape[2]
+
+    def _detect_batch(self, images, confidences):
+        if self._fixed_batch == 1 and len(images) > 1:
+            return [self._detect_batch([img], [confidence])[0] for img, confidence in zip(images, confidences)]
+
+        blob = cv2.dnn.blobFromImages(images, 1 / 255.0, (self.input_size, self.input_size), swapRB=True, crop=False)
+        output = self._session.run(None, {self._input_name: blob})[0]
+
+        results = []
+        for i, img in enumerate(images):
+            height, width = img.shape[:2]
+            rows = output[i]
+            if rows.shape[0] < rows.shape[1]:
+                rows = rows.T
+            boxes = rows[:, :4] / self.input_size
+            if rows.shape[1] == 85:
+                scores = rows[:, 5:] * rows[:, 4:5]
+            else:
+                scores = rows[:, 4:]
+            results.append(select_boxes(boxes, scores, width, height, confidences[i], self.class_ids))
+        return results
+
+
+class CvlibDetector(Detector):
+    ''' cvlib.detect_common_objects(), the network is managed by cvlib. input_size and threads are not used. '''
+
+    name = 'cvlib'
+
+    def _load(self):
+        import cvlib
+        self._cvlib = cvlib
+
+    def _detect_batch(self, images, confidences):
+        results = []
+        for img, confidence in zip(images, confidences):
+            bbox, labels, conf = self._cvlib.detect_common_objects(img, model=self.model, confidence=confidence, enable_gpu=self.gpu)
+            results.append(([box for box, label in zip(bbox, labels) if label == 'person'],
+                            [c for c, label in zip(conf, labels) if label == 'person']))
+        return results
+
+
+BACKENDS = {detector.name: detector for detector in (OpenCvDetector, OnnxDetector, CvlibDetector)}
+
+
+def fixed_input_size(backend, model):
+    ''' Input size dictated by the model (ONNX model exported with a fixed shape), None if the model takes the configured size.
+    For the worker pool, where the network is loaded in other processes: only the model description is read, the graph is not optimized. '''
+    if backend != 'onnx':
+        return None
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+    shape = onnxruntime.InferenceSession(model, options, providers=['CPUExecutionProvider']).get_inputs()[0].shape
+    return shape[2] if isinstance(shape[2], int) else None
+
+
+def create_detector(backend='opencv', model='yolov4', gpu=False, input_size=416, threads=0):
+    ''' Create the detector of the backend (not loaded, call load()) '''
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend: ' + str(backend))
+    return BACKENDS[backend](model, gpu, input_size, threads)
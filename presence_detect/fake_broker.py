@@ -0,0 +1,195 @@
+'''
+Minimal local stand-in for the MQTT brocker (MQTT 3.1.1, no authentication, no message routing).
+
+It accepts connections, acknowledges messages of all QoS levels and remembers everything that was published,
+so the publisher can be checked without the real brocker.
+
+Run the file to check publisher.py:
+    python -m presence_detect.fake_broker
+'''
+
+import socket
+import struct
+import threading
+import time
+
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP, SUBSCRIBE, SUBACK = 1, 2, 3, 4, 5, 6, 7, 8, 9
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+class FakeBroker:
+    ''' MQTT brocker stand-in.
+
+    Keyword arguments:
+    host, port -- address to listen on (port 0 - any free port, see self.port after start());
+    delay -- pause before processing every packet, sec (simulates a slow brocker);
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.messages = []      # (topic, payload, qos, retain) in the order of receiving
+        self.retained = {}      # topic -> payload
+        self.connects = 0
+        self._received = threading.Condition()
+        self._server = None
+        self._clients = []
+        self._running = False
+
+    def start(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen()
+        self.port = self._server.getsockname()[1]
+        self._running = True
+        threading.Thread(target=self._accept_loop, name='fake-broker', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+        for sock in [self._server] + self._clients:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        self._clients = []
+
+    def wait_for(self, count, timeout=5):
+        ''' Wait until at least count messages are received, return True on success '''
+        with self._received:
+            return self._received.wait_for(lambda: len(self.messages) >= count, timeout)
+
+    def topics(self):
+        return [message[0] for message in self.messages]
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            self._clients.append(client)
+            threading.Thread(target=self._client_loop, args=(client,), daemon=True).start()
+
+    def _read_exactly(self, sock, size):
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('connection closed')
+            data += chunk
+        return data
+
+    def _read_packet(self, sock):
+        header = self._read_exactly(sock, 1)[0]
+        length, multiplier = 0, 1
+        while True:
+            byte = self._read_exactly(sock, 1)[0]
+            length += (byte & 0x7f) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return header >> 4, header & 0x0f, self._read_exactly(sock, length)
+
+    def _client_loop(self, sock):
+        try:
+            while self._running:
+                packet_type, flags, body = self._read_packet(sock)
+                if self.delay:
+                    time.sleep(self.delay)
+
+                if packet_type == CONNECT:
+                    self.connects += 1
+                    sock.sendall(bytes([CONNACK << 4, 2, 0, 0]))
+                elif packet_type == PUBLISH:
+                    self._on_publish(sock, flags, body)
+                elif packet_type == PUBREL:
+                    sock.sendall(bytes([PUBCOMP << 4, 2]) + body[:2])
+                elif packet_type == SUBSCRIBE:
+                    packet_id, topics, position = body[:2], 0, 2
+                    while position < len(body):
+                        topic_length = struct.unpack('!H', body[position:position + 2])[0]
+                        position += 2 + topic_length + 1
+                        topics += 1
+                    sock.sendall(bytes([SUBACK << 4, 2 + topics]) + packet_id + bytes(topics))
+                elif packet_type == PINGREQ:
+                    sock.sendall(bytes([PINGRESP << 4, 0]))
+                elif packet_type == DISCONNECT:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            sock.close()
+
+    def _on_publish(self, sock, flags, body):
+        qos = (flags >> 1) & 3
+        retain = bool(flags & 1)
+        topic_length = struct.unpack('!H', body[:2])[0]
+        topic = body[2:2 + topic_length].decode()
+        position = 2 + topic_length
+        if qos:
+            packet_id = body[position:position + 2]
+            position += 2
+        payload = body[position:].decode(errors='replace')
+
+        with self._received:
+            self.messages.append((topic, payload, qos, retain))
+            if retain:
+                self.retained[topic] = payload
+            self._received.notify_all()
+
+        if qos == 1:
+            sock.sendall(bytes([PUBACK << 4, 2]) + packet_id)
+        elif qos == 2:
+            sock.sendall(bytes([PUBREC << 4, 2]) + packet_id)
+
+
+def check_publisher():
+    ''' Check publisher.py against the stand-in brocker '''
+    from . import publisher
+
+    broker = FakeBroker().start()
+    client = publisher.MqttPublisher('127.0.0.1', broker.port, 'check_publisher', qos=1)
+    client.add_discovery('homeassistant/binary_sensor/check/presence/config', '{}')
+    client.start()
+
+    # publish() doesn't wait for the connection
+    started = time.monotonic()
+    for i in range(10):
+        client.publish('check/presence', str(i % 2 == 0))
+    assert time.monotonic() - started < 0.1, 'publish() blocks'
+    assert broker.wait_for(11), 'messages are not delivered'
+    assert broker.topics()[0] == 'homeassistant/binary_sensor/check/presence/config', 'discovery is not the first message'
+    assert 'homeassistant/binary_sensor/check/presence/config' in broker.retained, 'discovery is not retained'
+    assert broker.connects == 1
+
+    # brocker restart: messages are queued while there is no connection, discovery is sent again after reconnect
+    port = broker.port
+    broker.stop()
+    time.sleep(0.5)
+    client.publish('check/presence', 'False', qos=0)
+    broker = FakeBroker(port=port).start()
+    assert broker.wait_for(2, timeout=90), 'no reconnect'
+    assert set(broker.topics()) == {'check/presence', 'homeassistant/binary_sensor/check/presence/config'}, broker.topics()
+
+    # slow brocker doesn't block the caller
+    client.stop()
+    broker.stop()
+    broker = FakeBroker(delay=0.2).start()
+    client = publisher.MqttPublisher('127.0.0.1', broker.port, 'check_publisher_slow', qos=1).start()
+    started = time.monotonic()
+    for i in range(20):
+        client.publish('check/presence', 'True')
+    assert time.monotonic() - started < 0.1, 'publish() blocks on slow brocker'
+    assert broker.wait_for(20, timeout=30), 'messages are lost on slow brocker'
+    client.stop()
+    broker.stop()
+    print('publisher.py: OK')
+
+
+if __name__ == "__main__":
+    check_publisher()
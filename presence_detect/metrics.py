@@ -0,0 +1,230 @@
+'''
+Metrics of the presence detection pipeline.
+
+Every stage (capture, preprocessing, inference, drawing, image save, MQTT publish) is timed, counters show
+processed, skipped and dropped frames. Metrics are available in Prometheus text format via a local HTTP server
+(http://<host>:<port>/metrics) and as a short JSON summary for the MQTT diagnostics sensor.
+
+Usage:
+    with metrics.stage('inference'):
+        ...
+    metrics.FRAMES_SKIPPED.inc(reason='motion')
+'''
+
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_text(names, values, extra=''):
+    parts = [name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _number(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Metric:
+    ''' Base class: a named metric with optional labels '''
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        ''' List of (suffix, label values, extra label text, value) '''
+        with self._lock:
+            return [('', key, '', value) for key, value in self._values.items()]
+
+    def expose(self):
+        lines = ['# HELP ' + self.name + ' ' + self.documentation, '# TYPE ' + self.name + ' ' + self.kind]
+        for suffix, key, extra, value in self.samples():
+            lines.append(self.name + suffix + _labels_text(self.labelnames, key, extra) + ' ' + _number(value))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    ''' Gauge, the value is either set or calculated by the function at scrape time '''
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.function is not None:
+            return [('', (), '', self.function())]
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        value = self._values.get(self._key(labels))
+        return value[0][-1] if value else 0
+
+    def average(self, **labels):
+        value = self._values.get(self._key(labels))
+        return value[1] / value[0][-1] if value and value[0][-1] else 0.0
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                for bound, count in zip(self.buckets, counts):
+                    result.append(('_bucket', key, 'le="' + _number(bound) + '"', count))
+                result.append(('_sum', key, '', total))
+                result.append(('_count', key, '', counts[-1]))
+        return result
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def expose(self):
+        return '\n'.join(metric.expose() for metric in self._metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram('presence_stage_duration_seconds', 'Duration of the pipeline stages', ('stage',)))
+FRAMES = REGISTRY.register(Counter('presence_frames_total', 'Frames taken from the cameras', ('camera',)))
+FRAMES_SKIPPED = REGISTRY.register(Counter('presence_frames_skipped_total', 'Frames not passed to the recognition', ('reason',)))
+FRAMES_DROPPED = REGISTRY.register(Counter('presence_frames_dropped_total', 'Frames dropped before processing', ('reason',)))
+DETECTIONS = REGISTRY.register(Counter('presence_detections_total', 'Results of the full recognition', ('result',)))
+MQTT_MESSAGES = REGISTRY.register(Counter('presence_mqtt_messages_total', 'MQTT messages', ('status',)))
+SNAPSHOTS = REGISTRY.register(Counter('presence_snapshots_total', 'Snapshots', ('status',)))
+INFO = REGISTRY.register(Gauge('presence_info', 'Model and settings of the detector', ('version', 'model', 'gpu', 'backend')))
+START_TIME = REGISTRY.register(Gauge('presence_start_time_seconds', 'Start time of the process (unix time)'))
+MOTION_SKIP_RATIO = REGISTRY.register(Gauge('presence_motion_gate_skip_ratio', 'Share of frames not recognized because the scene has not changed', ('camera',)))
+MOTION_CPU_SAVED = REGISTRY.register(Gauge('presence_motion_gate_cpu_saved_seconds', 'Estimated CPU time saved by the motion gate', ('camera',)))
+START_TIME.set(time.time())
+
+
+_samples = None     # stage -> list of durations, kept only when enabled by record_samples() (benchmark)
+
+
+@contextmanager
+def stage(name):
+    ''' Measure the duration of the block as a pipeline stage '''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def observe_stage(name, duration):
+    ''' Register the duration of a stage measured elsewhere (e.g. in a worker process), sec '''
+    STAGE_SECONDS.observe(duration, stage=name)
+    if _samples is not None:
+        _samples.setdefault(name, []).append(duration)
+
+
+def record_samples(enable=True):
+    ''' Keep every measured duration (histograms don't allow exact percentiles). Not for the long-running mode. '''
+    global _samples
+    _samples = {} if enable else None
+
+
+def samples():
+    return _samples or {}
+
+
+def set_info(version, model, gpu, backend='opencv'):
+    INFO.set(1, version=version, model=model, gpu=str(bool(gpu)).lower(), backend=backend)
+
+
+def register_gauge(name, documentation, function):
+    ''' Add a gauge calculated at scrape time (e.g. frames dropped by the grabber threads) '''
+    return REGISTRY.register(Gauge(name, documentation, function=function))
+
+
+def summary():
+    ''' Short summary for the MQTT diagnostics sensor '''
+    result = {}
+    for key in list(STAGE_SECONDS._values):
+        result[key[0] + '_ms_avg'] = round(STAGE_SECONDS.average(stage=key[0]) * 1000, 1)
+    result['frames'] = sum(FRAMES._values.values())
+    result['frames_skipped'] = sum(FRAMES_SKIPPED._values.values())
+    result['frames_dropped'] = sum(FRAMES_DROPPED._values.values())
+    for key in INFO._values:
+        result['model'], result['gpu'], result['backend'] = key[1], key[2] == 'true', key[3]
+    result['uptime_s'] = round(time.time() - START_TIME._values[()])
+    return result
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.expose().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host='0.0.0.0'):
+    ''' Start the metrics endpoint on a background thread '''
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,99 @@
+'''
+Cheap scene change check before the object recognition.
+
+The frame is reduced to a small grayscale image and compared with the frame of the last full recognition.
+If the share of changed pixels is below the threshold, the scene is considered unchanged and the previous result is used,
+so YOLO is not run on the same picture again (typical for an empty room at night).
+The full recognition is forced anyway when max_interval has passed since the last one.
+
+With the worker pool the result comes back later, when changed() may have been called for newer frames: the caller keeps
+the reduced frame (candidate) with the job and gives it back to register(), so the reference belongs to the recognized frame.
+'''
+
+import time
+
+import cv2
+
+
+class MotionGate:
+    ''' Frame differencing prefilter.
+
+    Keyword arguments:
+    threshold -- share of changed pixels (0..1) starting from which the scene is considered changed;
+    pixel_threshold -- minimal brightness difference (0..255) of a pixel to count it as changed;
+    width -- width of the reduced image used for comparison, px;
+    max_interval -- maximal time between full recognitions, sec;
+    '''
+
+    def __init__(self, threshold=0.01, pixel_threshold=25, width=160, max_interval=300):
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.width = width
+        self.max_interval = max_interval
+
+        self.verdict = None         # result of the last full recognition
+        self.last_change = 0.0      # share of changed pixels in the last checked frame
+        self._reference = None      # reduced frame of the last full recognition
+        self.candidate = None       # reduced frame of the last changed() call, becomes the reference after register()
+        self._detected_at = 0.0
+
+        self.frames = 0
+        self.skipped = 0
+        self.gate_cpu = 0.0         # CPU time spent on the checks, sec
+        self.detections = 0
+        self.detection_cpu = 0.0    # CPU time spent on full recognitions, sec
+
+    def _reduce(self, img):
+        height = max(1, round(img.shape[0] * self.width / img.shape[1]))
+        small = cv2.resize(img, (self.width, height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        # blur removes the sensor noise, otherwise the noise alone exceeds the threshold in the dark
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def changed(self, img):
+        ''' Check the frame. Returns True if the full recognition is needed, False if the previous result (self.verdict) can be used. '''
+        started = time.process_time()
+        self.frames += 1
+        self.candidate = self._reduce(img)
+
+        if self._reference is None or self.verdict is None or self._reference.shape != self.candidate.shape:
+            result = True
+        elif time.monotonic() - self._detected_at >= self.max_interval:
+            result = True
+        else:
+            diff = cv2.absdiff(self.candidate, self._reference)
+            self.last_change = cv2.countNonZero(cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)[1]) / diff.size
+            result = self.last_change >= self.threshold
+
+        if not result:
+            self.skipped += 1
+        self.gate_cpu += time.process_time() - started
+        return result
+
+    def register(self, person_found, detection_cpu=0.0, reference=None):
+        ''' Remember the result of the full recognition.
+
+        Keyword arguments:
+        person_found -- recognition result (type: bool);
+        detection_cpu -- CPU time spent on the recognition, sec (used for statistics);
+        reference -- self.candidate taken right after changed() for the recognized frame (None - the frame of the last changed() call);
+        '''
+        self.verdict = person_found
+        self._reference = self.candidate if reference is None else reference
+        self._detected_at = time.monotonic()
+        self.detections += 1
+        self.detection_cpu += detection_cpu
+
+    def stats(self):
+        avg_detection = self.detection_cpu / self.detections if self.detections else 0.0
+        return {
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'skip_ratio': round(self.skipped / self.frames, 3) if self.frames else 0.0,
+            'last_change': round(self.last_change, 4),
+            'gate_cpu_ms_avg': round(self.gate_cpu / self.frames * 1000, 2) if self.frames else 0.0,
+            'detection_cpu_ms_avg': round(avg_detection * 1000, 1),
+            # estimate: every skipped frame would cost the average recognition, minus the price of all checks
+            'cpu_saved_s': round(self.skipped * avg_detection - self.gate_cpu, 2),
+        }
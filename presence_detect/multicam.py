@@ -0,0 +1,186 @@
+'''
+Multi-camera mode: one process serves several video sources with one shared detector (see detector.py).
+
+Cameras are described by a JSON list, every element is an object:
+    {"source": "rtsp://...", "device_id": 1, "confidence": 65, "topic": "room/presence", "period": 30, "send_interval": 300,
+     "roi": "0,0.3,1,1", "input_size": 416}
+Only "source" is required, other values are taken from the common settings. Every camera needs its own source:
+a frame of the grabber is given out only once (see capture.py), so two cameras can't share one stream.
+Frames of all cameras that are due for the check are recognized in one batch, or are given to the pool of worker processes (see workers.py).
+'''
+
+import json
+import os
+import threading
+import time
+
+from . import capture, metrics, roi
+
+
+class Camera:
+    ''' Settings and state of one camera.
+
+    Keyword arguments:
+    source -- camera identifier (type: int) or video stream address (type: str);
+    device -- device information (type: tuple), same as DEVICE_INFO;
+    confidence -- minimal confidence (0..1);
+    topic -- MQTT topic of the state (None - default topic of the device);
+    period -- camera snapshot period, sec;
+    send_interval -- the period of regular sending of data to the server even if there are no changes, sec;
+    motion_gate -- motion.MotionGate of the camera or None;
+    preprocessor -- roi.Preprocessor of the camera or None;
+    tracker -- tracking.PresenceTracker of the camera or None;
+    debouncer -- tracking.Debouncer of the camera or None;
+    '''
+
+    def __init__(self, source, device, confidence=0.65, topic=None, period=30, send_interval=300, motion_gate=None, preprocessor=None,
+                 tracker=None, debouncer=None):
+        self.source = source
+        self.device = device
+        self.confidence = confidence
+        self.topic = topic
+        self.period = period
+        self.send_interval = send_interval
+        self.motion_gate = motion_gate
+        self.preprocessor = preprocessor
+        self.tracker = tracker
+        self.debouncer = debouncer
+
+        self.previous_state = None
+        self.next_due = 0.0
+
+    @property
+    def name(self):
+        return self.device[0]
+
+
+def load_cameras(config, make_device, confidence=65, period=30, send_interval=300, make_motion_gate=None, roi_spec='', input_size=0,
+                 make_tracker=None, make_debouncer=None):
+    ''' Create cameras from the JSON list.
+
+    Keyword arguments:
+    config -- path to JSON file or JSON string;
+    make_device -- function, returns device information (type: tuple) by device_id;
+    confidence -- default minimal confidence, percent (1-99, same scale as the "confidence" key of a camera);
+    period, send_interval -- default values;
+    make_motion_gate -- function without arguments that creates motion.MotionGate for a camera (None - no motion gate);
+    roi_spec, input_size -- default regions of interest and model input size (see roi.py);
+    make_tracker, make_debouncer -- functions without arguments that create tracking.PresenceTracker and tracking.Debouncer for a camera;
+    Raises ValueError if two cameras have the same source.
+    '''
+    if os.path.isfile(config):
+        with open(config) as f:
+            items = json.load(f)
+    else:
+        items = json.loads(config)
+
+    cameras = []
+    for index, item in enumerate(items):
+        source = str(item['source'])
+        if str.isnumeric(source):
+            source = int(source)
+        if any(camera.source == source for camera in cameras):
+            raise ValueError('Camera ' + str(index) + ': source ' + str(source) + ' is already used by another camera')
+        preprocessor = roi.Preprocessor(item.get('roi', roi_spec), item.get('input_size', input_size))
+        cameras.append(Camera(
+            source,
+            make_device(item.get('device_id', index)),
+            item.get('confidence', confidence) / 100,
+            item.get('topic'),
+            item.get('period', period),
+            item.get('send_interval', send_interval),
+            make_motion_gate() if make_motion_gate else None,
+            preprocessor if preprocessor.active else None,
+            make_tracker() if make_tracker else None,
+            make_debouncer() if make_debouncer else None,
+        ))
+    return cameras
+
+
+class MultiCameraLoop:
+    ''' Periodic check of all cameras with batched recognition.
+
+    Keyword arguments:
+    cameras -- list of Camera;
+    detector -- detector.Detector (loaded), not used with the pool;
+    on_result -- function(camera, found, image, bbox, conf), called after every check, bbox (frame coordinates) is None if recognition was skipped;
+    on_heartbeat -- function(camera), called every camera.send_interval seconds;
+    pool -- workers.InferencePool (started) or None, the results are handled on its result thread;
+    '''
+
+    def __init__(self, cameras, detector, on_result, on_heartbeat, pool=None):
+        self.cameras = cameras
+        self.detector = detector
+        self.on_result = on_result
+        self.on_heartbeat = on_heartbeat
+        self.pool = pool
+        self.tick_period = min(camera.period for camera in cameras)
+        # state of the cameras (tracker, motion gate, debouncer) is changed by the tick and by the result thread of the pool
+        self._lock = threading.Lock()
+        if pool is not None:
+            pool.on_result = self._on_pool_result
+
+    def schedule(self, tasks):
+        ''' Add tasks to scheduler.Scheduler '''
+        tasks.add('cameras', self.tick, self.tick_period)
+        for camera in self.cameras:
+            tasks.add('heartbeat-' + camera.name, lambda camera=camera: self.on_heartbeat(camera), camera.send_interval)
+
+    def tick(self):
+        now = time.monotonic()
+        # small tolerance, so a camera is not postponed for the whole tick because of the scheduler jitter
+        due = [camera for camera in self.cameras if camera.next_due <= now + self.tick_period * 0.1]
+
+        batch = []
+        for camera in due:
+            camera.next_due = now + camera.period
+            with metrics.stage('capture'):
+                image = capture.get_grabber(camera.source).read()
+            if image is None:
+                metrics.FRAMES_DROPPED.inc(reason='no_frame')
+                continue
+            metrics.FRAMES.inc(camera=camera.name)
+            with self._lock:
+                if camera.tracker is not None and camera.tracker.confirm(image):
+                    metrics.FRAMES_SKIPPED.inc(reason='tracking')
+                    self.on_result(camera, True, image, None, None)
+                    continue
+                with metrics.stage('preprocessing'):
+                    processed, transform = camera.preprocessor(image) if camera.preprocessor else (image, None)
+                if camera.motion_gate is not None and not camera.motion_gate.changed(processed):
+                    metrics.FRAMES_SKIPPED.inc(reason='motion')
+                    self.on_result(camera, camera.motion_gate.verdict, image, None, None)
+                    continue
+                # the gate may check newer frames before the result comes back: the reference frame goes with the job
+                reference = camera.motion_gate.candidate if camera.motion_gate is not None else None
+            if self.pool is not None:
+                self.pool.submit(camera.name, processed, camera.confidence, (camera, image, transform, reference))
+                continue
+            batch.append((camera, image, processed, transform, reference))
+
+        if not batch:
+            return
+
+        started = time.process_time()
+        with metrics.stage('inference'):
+            results = self.detector.detect_batch([item[2] for item in batch], [item[0].confidence for item in batch])
+        detection_cpu = (time.process_time() - started) / len(batch)
+
+        for (camera, image, _, transform, reference), (bbox, conf) in zip(batch, results):
+            self._handle_detections(camera, image, transform, bbox, conf, detection_cpu, reference)
+
+    def _on_pool_result(self, key, context, bbox, conf, detection_cpu):
+        camera, image, transform, reference = context
+        self._handle_detections(camera, image, transform, bbox, conf, detection_cpu, reference)
+
+    def _handle_detections(self, camera, image, transform, bbox, conf, detection_cpu, reference=None):
+        if transform is not None:
+            bbox, _, conf = transform.to_frame(bbox, ['person'] * len(bbox), conf)
+        found = len(bbox) > 0
+        metrics.DETECTIONS.inc(result='person' if found else 'nobody')
+        with self._lock:
+            if camera.tracker is not None:
+                camera.tracker.start(image, bbox)
+            if camera.motion_gate is not None:
+                camera.motion_gate.register(found, detection_cpu, reference)
+            self.on_result(camera, found, image, bbox, conf)
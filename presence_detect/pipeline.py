@@ -0,0 +1,473 @@
+'''
+Pipeline of the presence detection system: camera -> preprocessing -> recognition -> MQTT.
+
+The same code serves the command line, the docker container (settings from the environment, see config.py) and the benchmark.
+Modules with heavy dependencies are imported only when the selected mode needs them: paho-mqtt - if the data is sent
+to the brocker, the snapshot writer - if the images are saved, the multi-camera loop - with the list of cameras.
+The network is loaded and warmed up before the first frame, while the camera is being opened by the grabber thread.
+With --workers the recognition runs in a pool of worker processes (see workers.py), the main process only prepares the frames
+and handles the results.
+'''
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from . import VERSION, capture, config, detector, metrics, motion, roi, scheduler, tracking
+
+
+FIRST_FRAME_TIMEOUT = 15    # how long to wait for the first frame of a camera to size the shared memory of the workers, sec
+
+snapshot_writer = None      # snapshots.SnapshotWriter, started by run() if the images are saved
+
+
+def utc_to_local(utc_dt):
+    return utc_dt.replace(tzinfo=timezone.utc).astimezone(tz=None)
+
+
+def to_log(message):
+    ''' Print message with current datetime '''
+    print("[" + utc_to_local(datetime.utcnow()).strftime('%H:%M:%S.%f')[:-3] + "] " + message)
+
+
+def device_info(device_id):
+    ''' Device information (type: tuple) for MQTT: id, model, manufacturer, software version '''
+    return (str(device_id), "Presence_sensor", "gofk2005@yandex.ru", VERSION)
+
+
+def parse_source(source):
+    ''' Camera identifier (type: int) if the value is numeric, otherwise video stream address '''
+    source = str(source)
+    if str.isnumeric(source):
+        return int(source)
+    return source
+
+
+def report_motion_gate(camera, motion_gate):
+    ''' Log the statistics of the motion gate of the camera and export the skip ratio and the saved CPU time as metrics '''
+    stats = motion_gate.stats()
+    metrics.MOTION_SKIP_RATIO.set(stats['skip_ratio'], camera=camera)
+    metrics.MOTION_CPU_SAVED.set(stats['cpu_saved_s'], camera=camera)
+    to_log("Motion gate stats (" + str(camera) + "): " + json.dumps(stats))
+
+
+def register_discovery(device, brocker, component, object_id, **sensor):
+    ''' Register a sensor of the device in the Home Assistant (MQTT Discovery). The device block is common for all sensors of the device,
+    sensor -- fields of the sensor (name, state_topic, unique_id, etc.). Returns the discovery topic and payload.'''
+    from . import publisher
+    client_id = device[0] + '_' + device[1]
+    topic = 'homeassistant/' + component + '/' + client_id + '/' + object_id + '/config'
+    payload = json.dumps(dict({"device": {"identifiers": [ client_id ],"manufacturer": device[2],"model": device[1],"name": device[0] + '_presence_sensor',
+                                          "sw_version": device[3]}}, **sensor))
+    # the data is sent as a retained message after every connect to the brocker
+    publisher.get_publisher(brocker, client_id).add_discovery(topic, payload)
+    return topic, payload
+
+
+def ha_discovery(device, brocker, mqtt_active=False, state_topic=None):
+    ''' Sending data about the device to the Home Assistant. Used by the MQTT Discovery module.
+    It is enough to call it once: the data is sent as a retained message after every connect to the brocker.
+
+    Keyword arguments:
+    device -- device information (type: tuple), see device_info();
+    broker -- information about MQTT Brocker (type: tuple);
+    state_topic -- topic of the sensor state (None - default topic "<device id>_<model>/presence");
+    '''
+    if mqtt_active:
+        client_id = device[0] + '_' + device[1]
+        topic, payload = register_discovery(device, brocker, 'binary_sensor', 'presence', device_class="motion", name=device[0] + '_presence_sensor',
+                                            payload_off=False, payload_on=True, state_topic=state_topic or client_id + '/presence', unique_id=client_id)
+        to_log("MQTT discovery registered (sent after every connect): " + topic + " " + payload)
+
+
+def ha_discovery_diagnostics(device, brocker, mqtt_active=False):
+    ''' Register the diagnostics sensor (pipeline metrics) of the device in the Home Assistant, same way as ha_discovery().
+    The sensor value is the average inference time, other metrics are its attributes. The data is sent by send_diagnostics().'''
+    if mqtt_active:
+        client_id = device[0] + '_' + device[1]
+        topic, _ = register_discovery(device, brocker, 'sensor', 'diagnostics', name=device[0] + '_presence_diagnostics', state_topic=client_id + '/diagnostics',
+                                      value_template="{{ value_json.inference_ms_avg | default(0) }}", unit_of_measurement="ms",
+                                      json_attributes_topic=client_id + '/diagnostics', entity_category="diagnostic", unique_id=client_id + '_diagnostics')
+        to_log("MQTT discovery registered (diagnostics): " + topic)
+
+
+def send_diagnostics(device, brocker, mqtt_active=False):
+    ''' Send the metrics summary (see metrics.py) to the diagnostics sensor '''
+    if mqtt_active:
+        from . import publisher
+        client_id = device[0] + '_' + device[1]
+        publisher.get_publisher(brocker, client_id).publish(client_id + '/diagnostics', json.dumps(metrics.summary()))
+
+
+def get_image(cam_id=0):
+    ''' Get the newest image from webcam. The camera stays open between calls, frames are read by a background thread (see capture.py)
+
+    Keyword arguments:
+    cam_id -- camera identifier (type: int) or video stream address (type: str)
+    '''
+    grabber = capture.get_grabber(cam_id)
+    with metrics.stage('capture'):
+        image = grabber.read()
+    if image is None:
+        metrics.FRAMES_DROPPED.inc(reason='no_frame')
+    else:
+        metrics.FRAMES.inc(camera=str(cam_id))
+    stats = grabber.stats()
+    to_log("Frame received. Capture latency: " + str(stats['capture_latency_ms']) + " ms, frame age: " + str(stats['frame_age_ms']) + " ms")
+    return image
+
+
+def image_processing(img, preprocessor=None):
+    ''' Image processing after receiving from the camera and before sending it to the object recognition function.
+    Crops the image to the regions of interest and letterboxes it to the model input size (see roi.py).
+    Returns the processed image and the transform to map detections back to the frame (None if the image is not changed).'''
+    if preprocessor is None:
+        return img, None
+    with metrics.stage('preprocessing'):
+        return preprocessor(img)
+
+
+def model_name(cfg):
+    ''' Model of the selected backend: path to ONNX file for the onnx backend, otherwise the YOLO version '''
+    if cfg.backend == 'onnx':
+        if not cfg.onnx_model:
+            raise ValueError('onnx backend requires the path to the model (--onnx_model)')
+        return cfg.onnx_model
+    return cfg.yolo
+
+
+def load_detector(backend='opencv', model='yolov4', gpu=False, input_size=416, threads=0):
+    ''' Load the network of the backend (see detector.py) and run the first (slowest) pass, so the first frame is recognized at full speed '''
+    started = time.perf_counter()
+    shared_detector = detector.create_detector(backend, model, gpu, input_size, threads).load(warmup=True)
+    to_log("Model loaded: " + backend + ", " + model + " (" + str(round(time.perf_counter() - started, 2)) + " s)")
+    return shared_detector
+
+
+def follow_model_input_size(cfg, model_input_size):
+    ''' A model with a fixed input shape (ONNX) overrides model_input_size. If the frames are letterboxed to model_input_size,
+    they are letterboxed to the real input size instead, otherwise every frame is resized twice and may be distorted.
+    Returns True if cfg.input_size is changed.'''
+    if not model_input_size or model_input_size == cfg.input_size or cfg.input_size != cfg.model_input_size:
+        return False
+    to_log("The model input is " + str(model_input_size) + " px (model_input_size " + str(cfg.model_input_size) + " is ignored), frames are letterboxed to it")
+    cfg.input_size = model_input_size
+    return True
+
+
+def frame_slot_bytes(cfg, sources):
+    ''' Size of a shared memory slot of the worker pool: the largest first frame of the cameras after the preprocessing.
+    A camera that gives no frame in time is counted with the letterbox size.
+
+    Keyword arguments:
+    sources -- list of (camera identifier, roi.Preprocessor or None);
+    '''
+    slot_bytes = cfg.input_size * cfg.input_size * 3
+    for source, preprocessor in sources:
+        image = capture.get_grabber(source).read(timeout=FIRST_FRAME_TIMEOUT)
+        if image is None:
+            to_log("No frame from " + str(source) + " to size the shared memory of the workers, " + str(slot_bytes) + " bytes per frame is used")
+            continue
+        if preprocessor is not None:
+            image, _ = preprocessor(image)
+        slot_bytes = max(slot_bytes, image.nbytes)
+    return slot_bytes
+
+
+def start_pool(cfg, sources, on_result=None):
+    ''' Start the inference worker processes (see workers.py), every worker loads and warms up the network.
+    The shared memory slots are sized by the first frames of the sources (see frame_slot_bytes()). '''
+    from . import workers
+
+    started = time.perf_counter()
+    slot_bytes = frame_slot_bytes(cfg, sources)
+    pool = workers.InferencePool(cfg.backend, model_name(cfg), cfg.use_gpu, cfg.model_input_size, cfg.threads, cfg.workers, slot_bytes,
+                                 on_result, to_log).start()
+    to_log("Inference workers started: " + str(pool.workers) + ", " + cfg.backend + ", " + model_name(cfg) +
+           " (" + str(round(time.perf_counter() - started, 2)) + " s)")
+    return pool
+
+
+def person_is_found(img, model, confidence=0.65, frame=None, transform=None, tracker=None):
+    ''' Image analysis, object recognition.
+
+    Keyword arguments:
+    img -- image returned by image_processing();
+    model -- loaded detector (see load_detector());
+    confidence -- minimal confidence (0..1);
+    frame, transform -- original frame and transform returned by image_processing(): detections are mapped back and drawn on the frame;
+    tracker -- tracking.PresenceTracker, gets the boxes of found persons to confirm the presence on the next frames without recognition;
+    '''
+    with metrics.stage('inference'):
+        bbox, conf = model.detect(img, confidence)
+    return process_detections(img, bbox, conf, frame, transform, tracker)
+
+
+def process_detections(img, bbox, conf, frame=None, transform=None, tracker=None):
+    ''' Second half of person_is_found(), also used for the results of the worker processes:
+    maps the boxes back to the frame, starts the tracker, draws the persons. Returns True if a person is found.'''
+    if transform is not None:
+        bbox, _, conf = transform.to_frame(bbox, ['person'] * len(bbox), conf)
+        img = frame
+
+    if tracker is not None:
+        # before drawing, otherwise the boxes get into the tracked patches
+        tracker.start(img, bbox)
+
+    person_found = len(bbox) > 0
+    if person_found:
+        with metrics.stage('drawing'):
+            detector.draw_bbox(img, bbox, conf)
+        to_log("Person found")
+    else:
+        to_log("Person NOT found")
+    metrics.DETECTIONS.inc(result='person' if person_found else 'nobody')
+
+    return person_found
+
+
+def save_image(img, person_found, state_changed=True, prefix=''):
+    ''' Put the image into the queue of the snapshot writer (see snapshots.py), the file is written to "img/<current date>" by a background thread.
+
+    Keyword arguments:
+    img -- image (with marked people, if found);
+    person_found -- recognition result (type: bool), used in the file name;
+    state_changed -- has the state changed since the previous check (for snapshot_mode = 'changes');
+    prefix -- added to the file name (e.g. camera id);
+    '''
+    dropped = snapshot_writer.dropped
+    snapshot_writer.submit(img, person_found, state_changed, prefix)
+    if snapshot_writer.dropped > dropped:
+        to_log("Snapshot writer queue is full, the image is not saved")
+
+
+def send_data(person, device, brocker, mqtt_active=False, qos=0, retain=False, topic=None):
+    ''' Send data to MQTT brocker. The message is put into the queue of the persistent connection (see publisher.py), the function doesn't wait for the brocker.
+
+    Keyword arguments:
+    person - are people detected in the image? (type: bool);
+    device - device information (type: tuple), see device_info();
+    broker - information about MQTT Brocker (type: tuple);
+    mqtt_active - is it necessary to transfer data to MQTT brocker;
+    qos - MQTT QoS level (0, 1 or 2);
+    retain - send as retained message;
+    topic - topic of the sensor state (None - default topic "<device id>_<model>/presence");
+    '''
+    if mqtt_active:
+        from . import publisher
+        client_id = device[0] + '_' + device[1]
+        topic = topic or client_id + '/presence'
+        publisher.get_publisher(brocker, client_id).publish(topic, str(person), qos, retain)
+        to_log("MQTT send. Topic:  " + topic + ", payload: " + str(person))
+
+
+def run_cameras(cfg, brocker):
+    ''' Multi-camera mode: all cameras from cfg.cameras share one detector, frames are recognized in batches (see multicam.py) '''
+    from . import multicam
+
+    make_motion_gate = (lambda: motion.MotionGate(cfg.motion_threshold / 100, max_interval=cfg.motion_max_interval)) if cfg.motion_gate else None
+    make_tracker = (lambda: tracking.PresenceTracker(cfg.track_threshold, cfg.revalidate_interval)) if cfg.tracking else None
+    cameras = multicam.load_cameras(cfg.cameras, device_info, cfg.confidence, cfg.period, cfg.send_interval, make_motion_gate, cfg.roi, cfg.input_size,
+                                    make_tracker, lambda: tracking.Debouncer(cfg.enter_frames, cfg.leave_frames))
+    to_log("Cameras: " + ", ".join(camera.name + " (" + str(camera.source) + ")" for camera in cameras))
+    for camera in cameras:
+        # the cameras are opened by the grabber threads while the model is loading
+        capture.get_grabber(camera.source)
+
+    if cfg.workers:
+        shared_detector = None
+        model_input_size = detector.fixed_input_size(cfg.backend, model_name(cfg))
+    else:
+        shared_detector = load_detector(cfg.backend, model_name(cfg), cfg.use_gpu, cfg.model_input_size, cfg.threads)
+        model_input_size = shared_detector.input_size
+    default_input_size = cfg.input_size
+    if follow_model_input_size(cfg, model_input_size):
+        for camera in cameras:
+            if camera.preprocessor is not None and camera.preprocessor.input_size == default_input_size:
+                # no frame is processed yet, the buffers are allocated for the new size on the first frame
+                camera.preprocessor.input_size = cfg.input_size
+    pool = start_pool(cfg, [(camera.source, camera.preprocessor) for camera in cameras]) if cfg.workers else None
+
+    def on_result(camera, found, image, bbox, conf):
+        if bbox is None:
+            to_log("Camera " + camera.name + ": recognition skipped (scene not changed or person tracked), result: " + str(found))
+        else:
+            to_log("Camera " + camera.name + ": " + ("Person found" if found else "Person NOT found"))
+            if found:
+                with metrics.stage('drawing'):
+                    detector.draw_bbox(image, bbox, conf)
+            if cfg.save_images_to_disk:
+                save_image(image, found, found != camera.previous_state, camera.name + "_")
+        found = camera.debouncer.update(found)
+        if found != camera.previous_state:
+            send_data(found, camera.device, brocker, cfg.use_mqtt, cfg.mqtt_qos, cfg.mqtt_retain, camera.topic)
+            camera.previous_state = found
+
+    def on_heartbeat(camera):
+        if camera.previous_state is not None:
+            send_data(camera.previous_state, camera.device, brocker, cfg.use_mqtt, cfg.mqtt_qos, cfg.mqtt_retain, camera.topic)
+        if camera.motion_gate is not None:
+            report_motion_gate(camera.name, camera.motion_gate)
+        if cfg.mqtt_diagnostics and camera is cameras[0]:
+            send_diagnostics(camera.device, brocker, cfg.use_mqtt)
+
+    for camera in cameras:
+        ha_discovery(camera.device, brocker, cfg.use_mqtt, camera.topic)
+    if cfg.mqtt_diagnostics:
+        # metrics are common for the process, the sensor is registered for the first camera
+        ha_discovery_diagnostics(cameras[0].device, brocker, cfg.use_mqtt)
+
+    tasks = scheduler.Scheduler()
+    multicam.MultiCameraLoop(cameras, shared_detector, on_result, on_heartbeat, pool).schedule(tasks)
+    try:
+        tasks.run()
+    finally:
+        if pool is not None:
+            # otherwise the workers killed at exit are taken for crashed ones and restarted
+            pool.stop()
+
+
+def run_single(cfg, brocker):
+    ''' One camera (cfg.source) '''
+    source = parse_source(cfg.source)
+    device = device_info(cfg.device_id)
+    confidence = cfg.confidence / 100
+
+    # the camera is opened by the grabber thread while the model is loading
+    capture.get_grabber(source)
+    if cfg.workers:
+        shared_detector = None
+        follow_model_input_size(cfg, detector.fixed_input_size(cfg.backend, model_name(cfg)))
+    else:
+        shared_detector = load_detector(cfg.backend, model_name(cfg), cfg.use_gpu, cfg.model_input_size, cfg.threads)
+        follow_model_input_size(cfg, shared_detector.input_size)
+
+    # the letterbox size is known only after the model is loaded
+    preprocessor = roi.Preprocessor(cfg.roi, cfg.input_size)
+    if not preprocessor.active:
+        preprocessor = None
+    pool = start_pool(cfg, [(source, preprocessor)]) if cfg.workers else None
+
+    if cfg.adaptive_period:
+        capture_period = scheduler.AdaptivePeriod(cfg.period, cfg.min_period, cfg.max_period, cfg.boost_duration, cfg.idle_after)
+    else:
+        capture_period = cfg.period
+    motion_gate = motion.MotionGate(cfg.motion_threshold / 100, max_interval=cfg.motion_max_interval) if cfg.motion_gate else None
+    tracker = tracking.PresenceTracker(cfg.track_threshold, cfg.revalidate_interval) if cfg.tracking else None
+    debouncer = tracking.Debouncer(cfg.enter_frames, cfg.leave_frames)
+
+    previous_state = None
+    # with the worker pool the results are handled on its result thread, concurrently with the next capture
+    state_lock = threading.Lock()
+
+    def update_state(found):
+        nonlocal previous_state
+        found = debouncer.update(found)
+        if found != previous_state:
+            send_data(found, device, brocker, cfg.use_mqtt, cfg.mqtt_qos, cfg.mqtt_retain)
+            previous_state = found
+        if cfg.adaptive_period:
+            capture_period.update(found)
+
+    def recognized(camera_snapshot, found, detection_cpu, reference=None):
+        if motion_gate is not None:
+            motion_gate.register(found, detection_cpu, reference)
+        if cfg.save_images_to_disk:
+            save_image(camera_snapshot, found, found != previous_state)
+        update_state(found)
+
+    def on_pool_result(key, context, bbox, conf, detection_cpu):
+        camera_snapshot, transform, reference = context
+        with state_lock:
+            found = process_detections(camera_snapshot, bbox, conf, camera_snapshot, transform, tracker)
+            recognized(camera_snapshot, found, detection_cpu, reference)
+
+    if pool is not None:
+        pool.on_result = on_pool_result
+
+    def detection_cycle():
+        camera_snapshot = get_image(source)
+        if camera_snapshot is None:
+            to_log("No frame from the camera")
+            return
+        with state_lock:
+            if tracker is not None and tracker.confirm(camera_snapshot):
+                metrics.FRAMES_SKIPPED.inc(reason='tracking')
+                to_log("Person tracked (score " + str(round(tracker.score, 2)) + "), recognition skipped")
+                update_state(True)
+                return
+            processed_image, transform = image_processing(camera_snapshot, preprocessor)
+            if motion_gate is not None and not motion_gate.changed(processed_image):
+                metrics.FRAMES_SKIPPED.inc(reason='motion')
+                to_log("Scene not changed (" + str(round(motion_gate.last_change * 100, 2)) + "% of pixels), previous result is used: " + str(motion_gate.verdict))
+                update_state(motion_gate.verdict)
+                return
+            if pool is not None:
+                # the gate may check newer frames before the result comes back: the reference frame goes with the job
+                reference = motion_gate.candidate if motion_gate is not None else None
+                pool.submit(source, processed_image, confidence, (camera_snapshot, transform, reference))
+                return
+            started = time.process_time()
+            found = person_is_found(processed_image, shared_detector, confidence, camera_snapshot, transform, tracker)
+            recognized(camera_snapshot, found, time.process_time() - started)
+
+    def heartbeat():
+        if previous_state is not None:
+            send_data(previous_state, device, brocker, cfg.use_mqtt, cfg.mqtt_qos, cfg.mqtt_retain)
+        if motion_gate is not None:
+            report_motion_gate(source, motion_gate)
+        if pool is not None:
+            to_log("Inference workers stats: " + json.dumps(pool.stats()))
+        if cfg.mqtt_diagnostics:
+            send_diagnostics(device, brocker, cfg.use_mqtt)
+
+    ha_discovery(device, brocker, cfg.use_mqtt)
+    if cfg.mqtt_diagnostics:
+        ha_discovery_diagnostics(device, brocker, cfg.use_mqtt)
+
+    tasks = scheduler.Scheduler()
+    tasks.add('capture', detection_cycle, capture_period)
+    tasks.add('heartbeat', heartbeat, cfg.send_interval)
+    try:
+        tasks.run()
+    finally:
+        if pool is not None:
+            # otherwise the workers killed at exit are taken for crashed ones and restarted
+            pool.stop()
+
+
+def run(cfg):
+    ''' Start the system with the settings returned by config.load() '''
+    global snapshot_writer
+
+    to_log("Starting")
+    if cfg.save_images_to_disk:
+        from . import snapshots
+        package_dir = os.path.dirname(os.path.realpath(__file__))
+        snapshot_writer = snapshots.SnapshotWriter(os.path.join(package_dir, "img"), cfg.snapshot_mode, cfg.jpeg_quality, cfg.snapshot_width,
+                                                   cfg.img_max_size_mb * 1024 * 1024, cfg.img_max_days, log=to_log)
+        snapshot_writer.start()
+
+    metrics.set_info(VERSION, os.path.basename(model_name(cfg)), cfg.use_gpu, cfg.backend)
+    metrics.register_gauge('presence_grabber_frames_dropped', 'Frames lost by the grabbers because of failed reads (all cameras)', capture.frames_dropped)
+    metrics.register_gauge('presence_grabber_frames_superseded', 'Frames replaced by newer ones before processing, normal between two checks (all cameras)',
+                           capture.frames_superseded)
+    if cfg.metrics_port:
+        metrics.start_http_server(cfg.metrics_port)
+
+    brocker = (cfg.mqtt_brocker_ip, cfg.mqtt_brocker_port)
+    if cfg.cameras:
+        run_cameras(cfg, brocker)
+    else:
+        run_single(cfg, brocker)
+
+
+def main(argv=None):
+    cfg = config.load(argv, log=to_log)
+    if cfg.version:
+        print('Version:', VERSION)
+        sys.exit()
+    run(cfg)
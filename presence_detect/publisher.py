@@ -0,0 +1,161 @@
+'''
+Persistent MQTT publisher for the presence detection system.
+
+One connection to the MQTT brocker is kept open for the whole life of the process (paho network loop runs on its own thread).
+Messages are put into an in-memory queue and sent by a separate thread, so a slow or unavailable brocker never blocks the detection loop.
+If the connection is lost, paho reconnects automatically, the queued messages are sent after reconnecting.
+Data for the "MQTT Discovery" module (Home Assistant) is sent once after every (re)connect as a retained message.
+'''
+
+import collections
+import threading
+
+import paho.mqtt.client as mqtt
+
+from . import metrics
+
+
+def make_client(client_id):
+    ''' Create paho client, paho-mqtt 2.x requires the callback API version as the first argument '''
+    if hasattr(mqtt, 'CallbackAPIVersion'):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id)
+    return mqtt.Client(client_id)
+
+
+class MqttPublisher:
+    ''' Long-lived MQTT connection with an outbound queue.
+
+    Keyword arguments:
+    host, port -- address of MQTT brocker;
+    client_id -- MQTT client identifier;
+    qos -- default QoS of the messages (0, 1 or 2);
+    retain -- default retained flag of the messages;
+    queue_size -- maximum number of messages waiting for sending, the oldest messages are dropped when the queue is full;
+    keepalive -- MQTT keepalive interval, sec;
+    '''
+
+    def __init__(self, host='127.0.0.1', port=1883, client_id='presence_detect', qos=0, retain=False, queue_size=1000, keepalive=60):
+        self.host = str(host)
+        self.port = int(port)
+        self.client_id = client_id
+        self.qos = qos
+        self.retain = retain
+        self.keepalive = keepalive
+
+        self._queue = collections.deque(maxlen=queue_size)
+        self._queue_changed = threading.Condition()
+        self._connected = False
+        self._stopped = False
+        self._discovery = {}    # topic -> payload, sent after every (re)connect
+
+        self.sent = 0
+        self.dropped = 0
+        self.connects = 0
+
+        self._client = make_client(client_id)
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._client.reconnect_delay_set(min_delay=1, max_delay=60)
+        self._worker = threading.Thread(target=self._send_loop, name='mqtt-publisher', daemon=True)
+
+    def start(self):
+        # connect_async() doesn't wait for the brocker, the connection is made by the network loop
+        self._client.connect_async(self.host, self.port, self.keepalive)
+        self._client.loop_start()
+        self._worker.start()
+        return self
+
+    def stop(self, timeout=5):
+        ''' Send the queued messages (waiting no longer than timeout, sec) and close the connection '''
+        with self._queue_changed:
+            self._queue_changed.wait_for(lambda: not self._queue or not self._connected, timeout)
+            self._stopped = True
+            self._queue_changed.notify_all()
+        self._worker.join(timeout)
+        self._client.disconnect()
+        self._client.loop_stop()
+
+    @property
+    def connected(self):
+        return self._connected
+
+    def pending(self):
+        return len(self._queue)
+
+    def publish(self, topic, payload, qos=None, retain=None):
+        ''' Put the message into the queue. Never blocks. '''
+        message = (topic, payload, self.qos if qos is None else qos, self.retain if retain is None else retain)
+        with self._queue_changed:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+                metrics.MQTT_MESSAGES.inc(status='dropped')
+            self._queue.append(message)
+            self._queue_changed.notify_all()
+
+    def add_discovery(self, topic, payload):
+        ''' Register the MQTT Discovery config. It is sent as a retained message now (if connected) and after every reconnect. '''
+        with self._queue_changed:
+            self._discovery[topic] = payload
+        if self._connected:
+            self.publish(topic, payload, qos=1, retain=True)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            return
+        self.connects += 1
+        with self._queue_changed:
+            self._connected = True
+            # discovery goes before the queued state messages, so Home Assistant knows the sensor when the state arrives
+            for topic, payload in reversed(list(self._discovery.items())):
+                self._queue.appendleft((topic, payload, 1, True))
+            self._queue_changed.notify_all()
+
+    def _on_disconnect(self, client, userdata, rc):
+        with self._queue_changed:
+            self._connected = False
+            self._queue_changed.notify_all()
+
+    def _send_loop(self):
+        while True:
+            with self._queue_changed:
+                self._queue_changed.wait_for(lambda: self._stopped or (self._connected and self._queue))
+                if self._stopped:
+                    return
+                topic, payload, qos, retain = self._queue.popleft()
+
+            with metrics.stage('mqtt_publish'):
+                info = self._client.publish(topic, payload, qos=qos, retain=retain)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.sent += 1
+                metrics.MQTT_MESSAGES.inc(status='sent')
+                continue
+
+            # The connection was lost between the check and the publish. Return the message to the queue and wait for reconnect.
+            with self._queue_changed:
+                self._queue.appendleft((topic, payload, qos, retain))
+                if info.rc == mqtt.MQTT_ERR_NO_CONN:
+                    self._connected = False
+                else:
+                    self._queue_changed.wait(1)
+
+
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+
+def get_publisher(brocker, client_id, qos=0, retain=False):
+    ''' Return the publisher for the brocker (type: tuple (ip, port)), create and start it on first use '''
+    key = (str(brocker[0]), int(brocker[1]))
+    with _publishers_lock:
+        publisher = _publishers.get(key)
+        if publisher is None:
+            publisher = MqttPublisher(key[0], key[1], client_id, qos, retain).start()
+            _publishers[key] = publisher
+        return publisher
+
+
+def stop_all(timeout=5):
+    with _publishers_lock:
+        for publisher in _publishers.values():
+            publisher.stop(timeout)
+        _publishers.clear()
@@ -0,0 +1,157 @@
+'''
+Regions of interest (ROI) and preprocessing of the frame before the object recognition.
+
+Only the part of the frame covering the regions of interest is passed to the recognition (ceiling, windows, etc. are cut off),
+pixels outside polygon regions are filled with black. Optionally the crop is reduced and letterboxed to the model input size,
+so the model gets a frame of the right size without distortion. Buffers are allocated once for the frame size.
+Detections are mapped back to the frame coordinates and clipped to the crop, detections with the center outside the regions are discarded.
+
+ROI format: regions separated by ";". A rectangle is "x1,y1,x2,y2", a polygon is "poly:x1,y1,x2,y2,x3,y3,...".
+If all values of a region are not greater than 1, they are fractions of the frame width/height, otherwise pixels.
+Example: "0,0.3,0.6,1;poly:1200,400,1900,400,1900,1400"
+'''
+
+import cv2
+import numpy as np
+
+
+LETTERBOX_COLOR = 114
+
+
+def parse_roi(spec):
+    ''' Parse ROI string, returns list of (kind, points), kind is 'rect' or 'poly', points - list of (x, y) '''
+    regions = []
+    for part in (spec or '').split(';'):
+        part = part.strip()
+        if not part:
+            continue
+        kind = 'rect'
+        if part.startswith('poly:'):
+            kind = 'poly'
+            part = part[len('poly:'):]
+        values = [float(value) for value in part.split(',')]
+        if len(values) % 2 or (kind == 'rect' and len(values) != 4) or (kind == 'poly' and len(values) < 6):
+            raise ValueError('Wrong ROI: ' + part)
+        regions.append((kind, list(zip(values[0::2], values[1::2]))))
+    return regions
+
+
+class Transform:
+    ''' Maps coordinates of the processed image back to the frame: frame = processed / scale - pad + offset.
+    bounds -- crop in the frame (x1, y1, x2, y2), mapped boxes are clipped to it (None - not clipped);
+    '''
+
+    def __init__(self, offset_x=0, offset_y=0, scale=1.0, pad_x=0, pad_y=0, contains=None, bounds=None):
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        self.scale = scale
+        self.pad_x = pad_x
+        self.pad_y = pad_y
+        self._contains = contains
+        self.bounds = bounds
+
+    def point_to_frame(self, x, y):
+        return (x - self.pad_x) / self.scale + self.offset_x, (y - self.pad_y) / self.scale + self.offset_y
+
+    def to_frame(self, bbox, labels, conf):
+        ''' Map boxes ([x1, y1, x2, y2]) to the frame, clip them to the crop and drop the ones with the center outside the regions '''
+        result = ([], [], [])
+        for box, label, c in zip(bbox, labels, conf):
+            x1, y1 = self.point_to_frame(box[0], box[1])
+            x2, y2 = self.point_to_frame(box[2], box[3])
+            if self.bounds is not None:
+                # a box may reach into the letterbox padding, which is outside the crop
+                left, top, right, bottom = self.bounds
+                x1, x2 = min(max(x1, left), right), min(max(x2, left), right)
+                y1, y2 = min(max(y1, top), bottom), min(max(y2, top), bottom)
+                if x2 <= x1 or y2 <= y1:
+                    continue
+            if self._contains is not None and not self._contains((x1 + x2) / 2, (y1 + y2) / 2):
+                continue
+            result[0].append([int(x1), int(y1), int(x2), int(y2)])
+            result[1].append(label)
+            result[2].append(c)
+        return result
+
+
+class Preprocessor:
+    ''' Crop to regions of interest and letterbox to the model input size.
+
+    Keyword arguments:
+    roi -- ROI string (see the module description), empty - the whole frame;
+    input_size -- size of the square model input, px (0 - don't resize);
+    '''
+
+    def __init__(self, roi='', input_size=0):
+        self.regions = parse_roi(roi)
+        self.input_size = input_size
+        self._frame_shape = None
+
+    @property
+    def active(self):
+        return bool(self.regions) or bool(self.input_size)
+
+    def _prepare(self, shape):
+        ''' Calculate the crop and allocate buffers for the frame size '''
+        height, width = shape[:2]
+        self._frame_shape = shape
+        self._polygons = []
+        for kind, points in self.regions:
+            if all(x <= 1 and y <= 1 for x, y in points):
+                points = [(x * width, y * height) for x, y in points]
+            if kind == 'rect':
+                (x1, y1), (x2, y2) = points
+                points = [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]
+            self._polygons.append(np.array(points, np.float32))
+
+        if self._polygons:
+            x, y, w, h = cv2.boundingRect(np.concatenate(self._polygons))
+            x1, y1 = max(x, 0), max(y, 0)
+            x2, y2 = min(x + w, width), min(y + h, height)
+        else:
+            x1, y1, x2, y2 = 0, 0, width, height
+        self._crop = (x1, y1, x2, y2)
+        crop_w, crop_h = x2 - x1, y2 - y1
+
+        # mask is needed only if some region is not a rectangle covering the whole crop
+        self._mask = None
+        if any(kind == 'poly' for kind, _ in self.regions) or len(self._polygons) > 1:
+            mask = np.zeros((crop_h, crop_w), np.uint8)
+            for polygon in self._polygons:
+                cv2.fillPoly(mask, [np.round(polygon - (x1, y1)).astype(np.int32)], 255)
+            self._mask = mask == 0
+            self._masked = np.empty((crop_h, crop_w) + tuple(shape[2:]), np.uint8)
+
+        self._scale, self._pad_x, self._pad_y = 1.0, 0, 0
+        self._canvas = None
+        if self.input_size:
+            self._scale = min(self.input_size / crop_w, self.input_size / crop_h)
+            new_w, new_h = max(1, round(crop_w * self._scale)), max(1, round(crop_h * self._scale))
+            self._pad_x, self._pad_y = (self.input_size - new_w) // 2, (self.input_size - new_h) // 2
+            self._canvas = np.full((self.input_size, self.input_size) + tuple(shape[2:]), LETTERBOX_COLOR, np.uint8)
+            self._resized = self._canvas[self._pad_y:self._pad_y + new_h, self._pad_x:self._pad_x + new_w]
+
+    def contains(self, x, y):
+        ''' Is the point (frame coordinates) inside any region of interest '''
+        return any(cv2.pointPolygonTest(polygon, (float(x), float(y)), False) >= 0 for polygon in self._polygons)
+
+    def __call__(self, img):
+        ''' Returns the processed image and Transform (None if no processing is configured).
+        The processed image is a reused buffer, it is valid until the next call. '''
+        if not self.active or img is None:
+            return img, None
+        if img.shape != self._frame_shape:
+            self._prepare(img.shape)
+
+        x1, y1, x2, y2 = self._crop
+        processed = img[y1:y2, x1:x2]
+        if self._mask is not None:
+            np.copyto(self._masked, processed)
+            self._masked[self._mask] = 0
+            processed = self._masked
+        if self._canvas is not None:
+            interpolation = cv2.INTER_AREA if self._scale < 1 else cv2.INTER_LINEAR
+            cv2.resize(processed, (self._resized.shape[1], self._resized.shape[0]), dst=self._resized, interpolation=interpolation)
+            processed = self._canvas
+
+        return processed, Transform(x1, y1, self._scale, self._pad_x, self._pad_y, self.contains if self._polygons else None, self._crop)
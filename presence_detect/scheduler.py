@@ -0,0 +1,104 @@
+'''
+Simple scheduler for periodic tasks of the presence detection system.
+
+Tasks are run on the current thread. Between tasks the thread sleeps until the nearest deadline,
+so the process doesn't load the CPU while waiting. The monotonic clock is used,
+so changing the system time doesn't affect the schedule.
+'''
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class AdaptivePeriod:
+    ''' Snapshot period that depends on the room state.
+
+    Right after the state change (somebody came or left) the camera is checked more often (min_period),
+    when the room stays empty for a long time the period grows step by step up to max_period.
+
+    Keyword arguments:
+    period -- normal period, sec;
+    min_period -- period used during boost_duration after the state change, sec;
+    max_period -- upper bound of the period when the room is empty, sec;
+    boost_duration -- how long to use min_period after the state change, sec;
+    idle_after -- after this time without people the period starts to grow, sec;
+    backoff_factor -- the period is multiplied by this value on every check of the empty room;
+    '''
+
+    def __init__(self, period=30, min_period=5, max_period=120, boost_duration=60, idle_after=600, backoff_factor=1.5):
+        self.period = period
+        self.min_period = min(min_period, period)
+        self.max_period = max(max_period, period)
+        self.boost_duration = boost_duration
+        self.idle_after = idle_after
+        self.backoff_factor = backoff_factor
+
+        self._state = None
+        self._changed_at = time.monotonic()
+        self._current = period
+
+    def update(self, person_found):
+        ''' Register the detection result, should be called after every check '''
+        now = time.monotonic()
+        if person_found != self._state:
+            self._state = person_found
+            self._changed_at = now
+            self._current = self.period
+            return
+
+        if not person_found and now - self._changed_at >= self.idle_after:
+            self._current = min(self._current * self.backoff_factor, self.max_period)
+        else:
+            self._current = self.period
+
+    def __call__(self):
+        if time.monotonic() - self._changed_at < self.boost_duration:
+            return self.min_period
+        return self._current
+
+
+class Scheduler:
+    ''' Runs periodic tasks at their deadlines and sleeps in between '''
+
+    def __init__(self):
+        self._queue = []
+        self._counter = itertools.count()   # keeps the order of tasks with equal deadlines
+        self._stop_event = threading.Event()
+
+    def add(self, name, func, period, delay=0):
+        ''' Add a periodic task.
+
+        Keyword arguments:
+        name -- task name (used in the log);
+        func -- function without arguments;
+        period -- period in seconds (number) or function without arguments that returns the period (e.g. AdaptivePeriod);
+        delay -- delay before the first run, sec;
+        '''
+        heapq.heappush(self._queue, (time.monotonic() + delay, next(self._counter), name, func, period))
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while self._queue and not self._stop_event.is_set():
+            deadline, _, name, func, period = self._queue[0]
+            timeout = deadline - time.monotonic()
+            if timeout > 0:
+                # wait() returns early only if stop() was called
+                if self._stop_event.wait(timeout):
+                    break
+                continue
+
+            heapq.heappop(self._queue)
+            func()
+
+            interval = period() if callable(period) else period
+            # Next run is counted from the deadline to avoid drift. If the task took longer than its period
+            # the missed runs are skipped instead of running them one after another.
+            next_deadline = deadline + interval
+            now = time.monotonic()
+            if next_deadline < now:
+                next_deadline = now
+            heapq.heappush(self._queue, (next_deadline, next(self._counter), name, func, period))
@@ -0,0 +1,162 @@
+'''
+Background saving of camera snapshots to disk.
+
+JPEG encoding and writing (slow on SD cards) are done by a separate thread, the detection loop only puts the frame into a bounded queue.
+If the disk can't keep up and the queue is full, new snapshots are dropped instead of delaying the detection.
+Snapshots are saved to "<base_dir>/<date>/<time>_<label>.jpg", old days are deleted when the size or age budget is exceeded.
+'''
+
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import cv2
+
+from . import metrics
+
+
+MODES = ('all', 'changes', 'person')
+
+
+def dir_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            total += dir_size(entry.path)
+        elif entry.is_file(follow_symlinks=False):
+            total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+class SnapshotWriter(threading.Thread):
+    ''' Snapshot writer thread.
+
+    Keyword arguments:
+    base_dir -- directory for the snapshots ("img" next to the script);
+    mode -- which frames to save: 'all', 'changes' (only when the state has changed) or 'person' (only frames with people);
+    quality -- JPEG quality (1..100);
+    max_width -- frames wider than this are reduced before saving, px (0 - original size);
+    max_bytes -- size budget of base_dir, the oldest days are deleted when it is exceeded (0 - no limit);
+    max_days -- days older than this are deleted (0 - no limit);
+    queue_size -- maximal number of snapshots waiting for saving;
+    log -- function for messages;
+    '''
+
+    def __init__(self, base_dir, mode='all', quality=90, max_width=0, max_bytes=0, max_days=0, queue_size=10, log=print):
+        super().__init__(name='snapshot-writer', daemon=True)
+        if mode not in MODES:
+            raise ValueError('Unknown snapshot mode: ' + str(mode))
+        self.base_dir = base_dir
+        self.mode = mode
+        self.quality = quality
+        self.max_width = max_width
+        self.max_bytes = max_bytes
+        self.max_days = max_days
+        self.log = log
+
+        self._queue = queue.Queue(queue_size)
+        self._created_dirs = set()
+        self._last_retention = None
+
+        self.saved = 0
+        self.dropped = 0
+        self.deleted_days = 0
+
+    def submit(self, img, person_found, state_changed=True, prefix=''):
+        ''' Put the frame into the queue if it should be saved in the current mode. Never blocks. Returns the file name or None. '''
+        if self.mode == 'changes' and not state_changed:
+            return None
+        if self.mode == 'person' and not person_found:
+            return None
+
+        # the name is made once, at the moment of the detection, so the log and the file always match
+        now = datetime.now()
+        file_name = os.path.join(self.base_dir, str(now.date()), now.strftime('%H%M%S_%f')[:-3] + "_" + prefix + ("Person" if person_found else "Nobody") + ".jpg")
+        try:
+            self._queue.put_nowait((img, file_name))
+        except queue.Full:
+            self.dropped += 1
+            metrics.SNAPSHOTS.inc(status='dropped')
+            return None
+        return file_name
+
+    def run(self):
+        while True:
+            img, file_name = self._queue.get()
+            try:
+                with metrics.stage('image_save'):
+                    self._write(img, file_name)
+                metrics.SNAPSHOTS.inc(status='saved')
+            except Exception as e:
+                metrics.SNAPSHOTS.inc(status='error')
+                self.log("Snapshot is not saved: " + file_name + " (" + str(e) + ")")
+            if self._last_retention is None or time.monotonic() - self._last_retention >= 600:
+                self._last_retention = time.monotonic()
+                self.apply_retention()
+            self._queue.task_done()
+
+    def flush(self):
+        ''' Wait until all queued snapshots are written '''
+        self._queue.join()
+
+    def _write(self, img, file_name):
+        directory = os.path.dirname(file_name)
+        if directory not in self._created_dirs:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+                self.log("Create directory: " + directory)
+            self._created_dirs.add(directory)
+
+        if self.max_width and img.shape[1] > self.max_width:
+            height = round(img.shape[0] * self.max_width / img.shape[1])
+            img = cv2.resize(img, (self.max_width, height), interpolation=cv2.INTER_AREA)
+
+        success, data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not success:
+            raise IOError('JPEG encoding failed')
+        with open(file_name, 'wb') as f:
+            f.write(data.tobytes())
+        self.saved += 1
+        self.log("Save file: " + file_name)
+
+    def apply_retention(self):
+        ''' Delete the oldest day directories exceeding max_days / max_bytes. The current day is never deleted. '''
+        if not (self.max_bytes or self.max_days) or not os.path.isdir(self.base_dir):
+            return
+
+        days = sorted(entry.name for entry in os.scandir(self.base_dir) if entry.is_dir() and self._is_day(entry.name))
+        today = str(date.today())
+        if today in days:
+            days.remove(today)
+
+        if self.max_days:
+            oldest_allowed = str(date.today() - timedelta(days=self.max_days))
+            while days and days[0] < oldest_allowed:
+                self._delete_day(days.pop(0))
+
+        if self.max_bytes:
+            total = dir_size(self.base_dir)
+            while days and total > self.max_bytes:
+                day = days.pop(0)
+                total -= dir_size(os.path.join(self.base_dir, day))
+                self._delete_day(day)
+
+    def _is_day(self, name):
+        try:
+            date.fromisoformat(name)
+            return True
+        except ValueError:
+            return False
+
+    def _delete_day(self, day):
+        path = os.path.join(self.base_dir, day)
+        shutil.rmtree(path, ignore_errors=True)
+        self._created_dirs.discard(path)
+        self.deleted_days += 1
+        self.log("Delete old snapshots: " + path)
+
+    def stats(self):
+        return {'saved': self.saved, 'dropped': self.dropped, 'queued': self._queue.qsize(), 'deleted_days': self.deleted_days}
@@ -0,0 +1,125 @@
+'''
+Cheap confirmation of presence between full recognitions and debouncing of the state.
+
+After a person is found, small grayscale patches of the detected boxes are remembered. On the next frames each patch is searched
+near its last position (normalized cross-correlation, cv2.matchTemplate). While the patches are found with enough confidence,
+the person is considered present without running YOLO. The full recognition runs again when the confidence drops
+or revalidate_interval has passed.
+
+Hysteresis: the state changes only after several identical results in a row, this removes the flapping of the MQTT sensor.
+'''
+
+import time
+
+import cv2
+
+
+class PresenceTracker:
+    ''' Tracks the boxes of the last successful recognition.
+
+    Keyword arguments:
+    threshold -- minimal correlation (0..1) of a patch to consider the person still present;
+    revalidate_interval -- maximal time without full recognition, sec;
+    search_margin -- the patch is searched in its box expanded by this share of the box size on every side;
+    patch_width -- patches are reduced to this width, px;
+    '''
+
+    def __init__(self, threshold=0.6, revalidate_interval=60, search_margin=0.5, patch_width=48):
+        self.threshold = threshold
+        self.revalidate_interval = revalidate_interval
+        self.search_margin = search_margin
+        self.patch_width = patch_width
+
+        self.score = 0.0
+        self._tracks = []       # [box, scale, patch]
+        self._started_at = 0.0
+
+        self.confirmed = 0
+        self.lost = 0
+
+    @property
+    def active(self):
+        return bool(self._tracks)
+
+    def _gray(self, img):
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+    def start(self, frame, bbox):
+        ''' Remember the boxes ([x1, y1, x2, y2], frame coordinates) of the persons found on the frame '''
+        gray = self._gray(frame)
+        self._tracks = []
+        for x1, y1, x2, y2 in bbox:
+            x1, y1 = max(int(x1), 0), max(int(y1), 0)
+            x2, y2 = min(int(x2), gray.shape[1]), min(int(y2), gray.shape[0])
+            if x2 - x1 < 4 or y2 - y1 < 4:
+                continue
+            scale = min(1.0, self.patch_width / (x2 - x1))
+            patch = cv2.resize(gray[y1:y2, x1:x2], None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            self._tracks.append([(x1, y1, x2, y2), scale, patch])
+        self._started_at = time.monotonic()
+
+    def reset(self):
+        self._tracks = []
+
+    def confirm(self, frame):
+        ''' Check that the tracked persons are still on the frame. Returns True if the full recognition can be skipped. '''
+        if not self._tracks:
+            return False
+        if time.monotonic() - self._started_at >= self.revalidate_interval:
+            self.reset()
+            return False
+
+        gray = self._gray(frame)
+        best = 0.0
+        for track in self._tracks:
+            (x1, y1, x2, y2), scale, patch = track
+            margin_x, margin_y = int((x2 - x1) * self.search_margin), int((y2 - y1) * self.search_margin)
+            sx1, sy1 = max(x1 - margin_x, 0), max(y1 - margin_y, 0)
+            sx2, sy2 = min(x2 + margin_x, gray.shape[1]), min(y2 + margin_y, gray.shape[0])
+            search = cv2.resize(gray[sy1:sy2, sx1:sx2], None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            if search.shape[0] < patch.shape[0] or search.shape[1] < patch.shape[1]:
+                continue
+            _, score, _, location = cv2.minMaxLoc(cv2.matchTemplate(search, patch, cv2.TM_CCOEFF_NORMED))
+            if score >= self.threshold:
+                # follow the person, the patch itself is kept from the recognition to avoid drifting to the background
+                nx1, ny1 = sx1 + int(location[0] / scale), sy1 + int(location[1] / scale)
+                track[0] = (nx1, ny1, nx1 + x2 - x1, ny1 + y2 - y1)
+            best = max(best, score)
+
+        self.score = best
+        if best >= self.threshold:
+            self.confirmed += 1
+            return True
+        self.lost += 1
+        self.reset()
+        return False
+
+
+class Debouncer:
+    ''' Hysteresis of the presence state.
+
+    Keyword arguments:
+    enter_frames -- number of positive results in a row to change the state to "present";
+    leave_frames -- number of negative results in a row to change the state to "absent";
+    '''
+
+    def __init__(self, enter_frames=1, leave_frames=1):
+        self.enter_frames = max(1, enter_frames)
+        self.leave_frames = max(1, leave_frames)
+        self.state = None
+        self._streak = 0
+
+    def update(self, found):
+        ''' Register the raw result, returns the debounced state '''
+        if self.state is None:
+            # the first result is taken as is, so the sensor gets a value right after the start
+            self.state = found
+            self._streak = 0
+        elif found == self.state:
+            self._streak = 0
+        else:
+            self._streak += 1
+            if self._streak >= (self.enter_frames if found else self.leave_frames):
+                self.state = found
+                self._streak = 0
+        return self.state
@@ -0,0 +1,292 @@
+'''
+Pool of inference worker processes.
+
+The recognition is the slowest stage, so it runs in separate processes and uses the other cores: capture, preprocessing,
+MQTT, snapshots and the heartbeat stay in the main process and are not delayed by a slow forward pass.
+
+Frames are passed through a fixed set of shared memory slots (multiprocessing.RawArray), only the slot number and the frame shape
+go through the pipe of the worker, the image itself is not pickled. Every worker loads the network once at start.
+
+Backpressure: there are two slots per worker. If all slots are busy, the frame waits in the main process, but only the newest frame
+of every camera is kept: the waiting frame of the same camera is dropped (metrics: frames dropped, reason "stale").
+A result that arrives after a newer result of the same camera is dropped too.
+
+Every worker has its own pipe, so the pool knows which tasks every worker holds, and a dead worker can't leave a shared queue locked.
+If a worker process dies (e.g. killed by the OOM killer), its tasks are counted as errors, their slots are freed and the worker is restarted.
+After MAX_RESTARTS restarts the pool is considered broken: submit() raises RuntimeError, so the service stops
+instead of waiting for results that never come.
+'''
+
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+
+import numpy as np
+
+from . import metrics
+
+MAX_RESTARTS = 5            # restarts of dead workers before the pool fails
+
+
+def _worker_main(backend, model, gpu, input_size, threads, slots, conn):
+    ''' Worker process: load the network, then recognize the frames received through the pipe '''
+    from . import detector
+
+    try:
+        shared_detector = detector.create_detector(backend, model, gpu, input_size, threads).load(warmup=True)
+    except Exception as e:
+        conn.send(('failed', os.getpid(), repr(e)))
+        return
+    conn.send(('ready', os.getpid(), None))
+
+    buffers = [np.frombuffer(slot, np.uint8) for slot in slots]
+    while True:
+        task = conn.recv()
+        if task is None:
+            return
+        task_id, slot, shape, image, confidence = task
+        if slot is not None:
+            image = buffers[slot][:int(np.prod(shape))].reshape(shape)
+        started, started_cpu = time.perf_counter(), time.process_time()
+        try:
+            bbox, conf = shared_detector.detect(image, confidence)
+            error = None
+        except Exception as e:
+            bbox, conf, error = [], [], repr(e)
+        conn.send((task_id, bbox, conf, time.perf_counter() - started, time.process_time() - started_cpu, error))
+
+
+class InferencePool:
+    ''' Worker processes with shared memory slots for the frames.
+
+    Keyword arguments:
+    backend, model, gpu, input_size, threads -- detector settings (see detector.create_detector()), threads are per worker;
+    workers -- number of worker processes;
+    slot_bytes -- size of a shared memory slot, larger frames are passed through the pipe (pickled);
+    on_result -- function(key, context, bbox, conf, detection_cpu), called on the result thread for every recognized frame;
+    log -- function for messages;
+    '''
+
+    def __init__(self, backend='opencv', model='yolov4', gpu=False, input_size=416, threads=0, workers=2, slot_bytes=1920 * 1080 * 3,
+                 on_result=None, log=print):
+        self.workers = max(1, workers)
+        self.slot_bytes = slot_bytes
+        self.on_result = on_result
+        self.log = log
+        if not threads:
+            # every worker would use all cores by default, this only adds context switches
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+
+        # spawn: the main process already runs threads (grabbers, paho), forking them is not safe
+        self._context = multiprocessing.get_context('spawn')
+        self._settings = (backend, model, gpu, input_size, threads)
+        self._slots = [self._context.RawArray('B', slot_bytes) for _ in range(self.workers * 2)]
+        self._buffers = [np.frombuffer(slot, np.uint8) for slot in self._slots]
+        self._processes = [None] * self.workers
+        self._conns = [None] * self.workers
+        self._assigned = [[] for _ in range(self.workers)]  # task ids sent to every worker, in order
+        self._stopping = False
+
+        self._lock = threading.Lock()
+        self._free = list(range(len(self._slots)))
+        self._pending = {}          # key -> (task id, image, confidence, context), waiting for a free slot
+        self._in_flight = {}        # task id -> (key, slot, context)
+        self._delivered = {}        # key -> task id of the last delivered result
+        self._next_id = 0
+        self._result_thread = threading.Thread(target=self._result_loop, name='inference-results', daemon=True)
+
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.restarts = 0
+        self.oversized = 0          # frames larger than a slot, passed through the pipe
+        self.failure = None         # error message after the pool has failed
+
+    def _spawn(self, index):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, name='inference-' + str(index), daemon=True,
+                                        args=self._settings + (self._slots, child_conn))
+        process.start()
+        child_conn.close()
+        self._processes[index], self._conns[index] = process, conn
+
+    def start(self, timeout=600):
+        ''' Start the workers and wait until every worker has loaded the network '''
+        for index in range(self.workers):
+            self._spawn(index)
+        for index, conn in enumerate(self._conns):
+            if not conn.poll(timeout):
+                raise RuntimeError('Inference worker ' + str(self._processes[index].pid) + ' has not started in ' + str(timeout) + ' s')
+            try:
+                status, pid, error = conn.recv()
+            except EOFError:
+                status, pid, error = 'failed', self._processes[index].pid, 'exit code ' + str(self._processes[index].exitcode)
+            if status != 'ready':
+                raise RuntimeError('Inference worker ' + str(pid) + ' failed to start: ' + str(error))
+        self._result_thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        with self._lock:
+            for conn in self._conns:
+                try:
+                    conn.send(None)
+                except (OSError, ValueError):
+                    pass
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._result_thread.join(timeout)
+
+    def submit(self, key, image, confidence=0.65, context=None):
+        ''' Queue the frame for the recognition. Never blocks.
+
+        Keyword arguments:
+        key -- camera identifier, only the newest frame of a key waits for a slot;
+        image -- image (uint8), it is copied before submit() returns, so the caller may reuse the buffer;
+        confidence -- minimal confidence (0..1);
+        context -- any object, returned to on_result() with the result;
+        Raises RuntimeError if the workers keep dying (see MAX_RESTARTS).
+        '''
+        if self.failure is not None:
+            raise RuntimeError(self.failure)
+        with self._lock:
+            self._next_id += 1
+            self.submitted += 1
+            task_id = self._next_id
+            if key in self._pending:
+                self._drop()
+            if self._free:
+                self._send(self._free.pop(), task_id, key, image, confidence, context)
+            else:
+                # the image may be a buffer reused by the preprocessor for the next frame
+                self._pending[key] = (task_id, image.copy(), confidence, context)
+
+    def _drop(self):
+        self.dropped += 1
+        metrics.FRAMES_DROPPED.inc(reason='stale')
+
+    def _send(self, slot, task_id, key, image, confidence, context):
+        ''' Copy the image into the slot and give the task to the least busy worker (called with the lock) '''
+        image = np.ascontiguousarray(image)
+        if image.nbytes <= self.slot_bytes:
+            np.copyto(self._buffers[slot][:image.nbytes].reshape(image.shape), image)
+            task = (task_id, slot, image.shape, None, confidence)
+        else:
+            if not self.oversized:
+                self.log("Frame " + str(image.shape) + " is larger than the shared memory slot (" + str(self.slot_bytes) + " bytes), it is passed through the pipe")
+            self.oversized += 1
+            task = (task_id, None, image.shape, image, confidence)
+        index = min(range(self.workers), key=lambda i: len(self._assigned[i]))
+        self._in_flight[task_id] = (key, slot, context)
+        self._assigned[index].append(task_id)
+        try:
+            self._conns[index].send(task)
+        except (OSError, ValueError):
+            pass # the worker is dead, the task is released when the result thread restarts it
+
+    def _release(self, slot):
+        ''' Give the slot to the oldest waiting camera or return it to the free list (called with the lock) '''
+        if slot is None:
+            return
+        if self._pending:
+            waiting_key = next(iter(self._pending))
+            waiting_id, waiting_image, waiting_confidence, waiting_context = self._pending.pop(waiting_key)
+            self._send(slot, waiting_id, waiting_key, waiting_image, waiting_confidence, waiting_context)
+        else:
+            self._free.append(slot)
+
+    def _restart(self, index):
+        ''' The worker has died: its tasks are lost, the worker is started again (called with the lock). Returns False if the pool has failed. '''
+        process = self._processes[index]
+        process.join(1) # the sentinel is ready, collect the exit code
+        lost, self._assigned[index] = self._assigned[index], []
+        self.log("Inference worker " + str(process.pid) + " exited with code " + str(process.exitcode) + ", lost frames: " + str(len(lost)))
+        self._conns[index].close()
+        self.errors += len(lost)
+        if self.restarts >= MAX_RESTARTS:
+            self.failure = 'Inference workers died ' + str(self.restarts + 1) + ' times, the pool is stopped'
+            self.log(self.failure)
+            return False
+        self.restarts += 1
+        self._spawn(index)
+        for task_id in lost:
+            _, slot, _ = self._in_flight.pop(task_id)
+            self._release(slot)
+        return True
+
+    def _result_loop(self):
+        while not self._stopping:
+            with self._lock:
+                conns = list(self._conns)
+                sentinels = {process.sentinel: index for index, process in enumerate(self._processes)}
+            ready = multiprocessing.connection.wait(conns + list(sentinels), timeout=1)
+            for item in ready:
+                if item in sentinels or self._stopping:
+                    continue
+                index = conns.index(item)
+                try:
+                    result = item.recv()
+                except (EOFError, OSError):
+                    continue # the worker has died, handled by its sentinel
+                self._handle(index, result)
+            for sentinel, index in sentinels.items():
+                if sentinel in ready and not self._stopping:
+                    self._drain(conns[index])
+                    with self._lock:
+                        if not self._restart(index):
+                            return
+
+    def _drain(self, conn):
+        ''' Results sent by the worker before it has died '''
+        index = self._conns.index(conn)
+        try:
+            while conn.poll():
+                self._handle(index, conn.recv())
+        except (EOFError, OSError):
+            pass
+
+    def _handle(self, index, result):
+        if len(result) == 3:
+            # a restarted worker has loaded the network
+            status, pid, error = result
+            self.log("Inference worker " + str(pid) + (" restarted" if status == 'ready' else " failed to start: " + str(error)))
+            return
+        task_id, bbox, conf, duration, detection_cpu, error = result
+        with self._lock:
+            self._assigned[index].remove(task_id)
+            key, slot, context = self._in_flight.pop(task_id)
+            # the oldest waiting camera goes first
+            self._release(slot)
+            stale = self._delivered.get(key, 0) > task_id
+            if not stale:
+                self._delivered[key] = task_id
+        metrics.observe_stage('inference', duration)
+        if error is not None:
+            self.errors += 1
+            self.log("Recognition failed: " + error)
+            return
+        if stale:
+            self._drop()
+            return
+        self.completed += 1
+        self.on_result(key, context, bbox, conf, detection_cpu)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'restarts': self.restarts,
+                'oversized': self.oversized,
+                'in_flight': len(self._in_flight),
+                'waiting': len(self._pending),
+            }
@@ -0,0 +1,192 @@
+"""
+Замер скорости сортировки (sortPhotosByDate.py) на синтетическом наборе файлов.
+
+Создается дерево из N файлов со смешанными расширениями (фото, RAW, видео, прочие), случайными датами изменения
+и повторяющимися именами (для проверки коллизий). Затем отдельно замеряются этапы (файлов/с):
+- walk - обход дерева и чтение атрибутов;
+- plan - построение плана (даты, целевые директории, коллизии имен);
+- copy - создание директорий и копирование по плану;
+- rerun - повторный запуск на том же наборе (все файлы пропускаются по журналу).
+Затем проверяется повторный запуск из другой текущей папки с относительными путями (--input/--output): уже отсортированные
+файлы не копируются заново, добавленная копия файла распознается как дубликат.
+Кэш файловой системы не сбрасывается: результат - скорость на "теплых" данных.
+
+Запуск: python3 benchmarkSort.py --files 10000 --threads 4 [--mode copy] [--dedup link] [--dir /mnt/nas/tmp] [--output result.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import sortPhotosByDate as sorter
+
+# расширения с весами: в архиве фото больше всего JPEG
+EXTENSIONS = [('jpg', 50), ('JPG', 15), ('png', 5), ('cr2', 5), ('nef', 5), ('raf', 3), ('dng', 2), ('mp4', 5), ('mov', 3), ('txt', 4), ('pdf', 3)]
+
+
+def makeTree(root, files, dirs, minSize, maxSize, seed=0):
+    """ Создаем синтетический набор файлов, возвращаем общий размер """
+    rng = random.Random(seed)
+    extensions = [ext for ext, weight in EXTENSIONS for _ in range(weight)]
+    folders = [os.path.join(root, 'dir' + str(i // 10), 'sub' + str(i)) for i in range(dirs)]
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+    block = os.urandom(maxSize)
+    first = time.mktime((2005, 1, 1, 0, 0, 0, 0, 0, -1))
+    last = time.mktime((2024, 12, 31, 0, 0, 0, 0, 0, -1))
+    total = 0
+    for i in range(files):
+        # имена повторяются в разных директориях - как у фото с разных камер (IMG_0001.jpg)
+        name = 'IMG_' + str(rng.randrange(files // 4 + 1)).zfill(4) + '.' + rng.choice(extensions)
+        path = os.path.join(rng.choice(folders), name)
+        if os.path.exists(path):
+            path = os.path.join(os.path.dirname(path), str(i) + '_' + name)
+        size = rng.randint(minSize, maxSize)
+        with open(path, 'wb') as f:
+            f.write(str(i).encode() + b'\n') # содержимое уникально - иначе все файлы окажутся дубликатами
+            f.write(block[:size])
+        mtime = rng.uniform(first, last)
+        os.utime(path, (mtime, mtime))
+        total += size
+    return total
+
+
+def rate(files, seconds):
+    return round(files / seconds, 1) if seconds > 0 else None
+
+
+def runSort(source, output, args):
+    """ Сортировка с замером этапов """
+    sorter.output_dir = output
+    sorter.logFile = os.path.join(os.path.dirname(output), 'sort.log')
+    sorter.manifestFile = os.path.join(output, '.sort_manifest.sqlite')
+    sorter.dedupFile = os.path.join(output, '.sort_hashes.sqlite')
+    sorter.dateCacheFile = os.path.join(output, '.sort_dates.sqlite')
+    sorter.mode = args.mode
+    sorter.copyThreads = args.threads
+    sorter.dedup = '' if args.dedup == 'none' else args.dedup
+    sorter.consoleLevel = 'error'
+    sorter.dryRun = False
+
+    sorter.startSort(source)
+    try:
+        started = time.perf_counter()
+        records = list(sorter.fileRecords(source))
+        walk = time.perf_counter() - started
+
+        started = time.perf_counter()
+        plan = sorter.buildPlan(records)
+        planTime = time.perf_counter() - started
+
+        started = time.perf_counter()
+        sorter.makeDirs()
+        sorter.executePlan(plan)
+        copy = time.perf_counter() - started
+        copied = sorter.engine.files + sorter.engine.duplicates
+    finally:
+        sorter.finishSort()
+    return {
+        'files': len(records),
+        'walk_s': round(walk, 3), 'walk_files_per_s': rate(len(records), walk),
+        'plan_s': round(planTime, 3), 'plan_files_per_s': rate(len(records), planTime),
+        'copy_s': round(copy, 3), 'copy_files_per_s': rate(copied, copy),
+    }
+
+
+def outputFiles(output):
+    """ Файлы целевой папки (без журнала и индексов): путь -> inode """
+    result = {}
+    for folder, _, names in os.walk(output):
+        for name in names:
+            if not name.startswith('.sort_'):
+                path = os.path.join(folder, name)
+                result[path] = os.stat(path).st_ino
+    return result
+
+
+def checkRerunFromOtherDir(root, args):
+    """ Сортировка с относительными путями, затем повторный запуск из другой папки с добавленной копией файла.
+    Возвращаем текст ошибки или None. """
+    check = os.path.join(root, 'check')
+    makeTree(os.path.join(check, 'in'), 20, 2, 100, 1000, seed=1)
+    options = ['--mode', args.mode, '--threads', str(args.threads), '--dedup', args.dedup, '--log_file', '', '--console_level', 'error']
+    cwd = os.getcwd()
+    try:
+        os.chdir(check)
+        sorter.main(['--input', 'in', '--output', 'out'] + options)
+        before = outputFiles(os.path.join(check, 'out'))
+        folder = os.path.join(check, 'in', os.listdir(os.path.join(check, 'in'))[0])
+        folder = os.path.join(folder, os.listdir(folder)[0])
+        original = os.path.join(folder, sorted(os.listdir(folder))[0])
+        shutil.copy2(original, os.path.join(folder, 'copy_' + os.path.basename(original)))
+        os.chdir(root)
+        sorter.main(['--input', os.path.join('check', 'in'), '--output', os.path.join('check', 'out')] + options)
+        after = outputFiles(os.path.join(check, 'out'))
+    finally:
+        os.chdir(cwd)
+    added = [path for path in after if path not in before]
+    if len(added) != (0 if args.dedup == 'skip' else 1):
+        return 'new files after rerun: ' + str(added)
+    if args.dedup == 'link' and after[added[0]] not in before.values():
+        return 'duplicate is copied instead of linked: ' + added[0]
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер скорости сортировки на синтетическом наборе файлов')
+    parser.add_argument('--files', type=int, default=10000, help='Количество файлов')
+    parser.add_argument('--dirs', type=int, default=100, help='Количество исходных директорий')
+    parser.add_argument('--min_size', type=int, default=1024, help='Минимальный размер файла, байт')
+    parser.add_argument('--max_size', type=int, default=256 * 1024, help='Максимальный размер файла, байт')
+    parser.add_argument('--mode', type=str, default='copy', choices=('copy', 'link'), help='Режим сортировки (move изменил бы исходный набор)')
+    parser.add_argument('--threads', type=int, default=4, help='Количество потоков копирования')
+    parser.add_argument('--dedup', type=str, default='link', choices=('link', 'skip', 'none'), help='Поиск дубликатов')
+    parser.add_argument('--dir', type=str, default=None, help='Где создать набор файлов (по умолчанию - временная папка)')
+    parser.add_argument('--keep', action='store_true', help='Не удалять набор файлов и результат')
+    parser.add_argument('--output', type=str, default=None, help='JSON файл для результатов')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='sort_benchmark_', dir=args.dir)
+    try:
+        source = os.path.join(root, 'in')
+        output = os.path.join(root, 'out')
+        print('Create ' + str(args.files) + ' files in ' + source, flush=True)
+        started = time.perf_counter()
+        size = makeTree(source, args.files, max(1, args.dirs), args.min_size, args.max_size)
+        print('  ' + str(round(size / 1024 / 1024, 1)) + ' MB, ' + str(round(time.perf_counter() - started, 1)) + ' s', flush=True)
+
+        result = runSort(source, output, args)
+        result['mb'] = round(size / 1024 / 1024, 1)
+        result['copy_mb_per_s'] = round(result['mb'] / result['copy_s'], 1) if result['copy_s'] > 0 else None
+
+        started = time.perf_counter()
+        rerun = runSort(source, output, args) # все файлы уже в журнале
+        result['rerun_s'] = round(time.perf_counter() - started, 3)
+        result['rerun_files_per_s'] = rate(rerun['files'], result['rerun_s'])
+        result.update({'mode': args.mode, 'threads': args.threads, 'dedup': args.dedup})
+
+        for stage in ('walk', 'plan', 'copy', 'rerun'):
+            print(stage + ': ' + str(result[stage + '_s']) + ' s, ' + str(result[stage + '_files_per_s']) + ' files/s')
+        print('copy: ' + str(result['copy_mb_per_s']) + ' MB/s')
+        error = checkRerunFromOtherDir(root, args)
+        result['rerun_other_dir'] = error or 'ok'
+        print('rerun from another directory: ' + result['rerun_other_dir'])
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(result, f, indent=2)
+            print('Results: ' + args.output)
+        if error:
+            raise SystemExit('Rerun from another directory failed')
+    finally:
+        if args.keep:
+            print('Files: ' + root)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
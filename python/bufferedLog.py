@@ -0,0 +1,154 @@
+"""
+Буферизованный лог: записи складываются в очередь, фоновый поток пишет их в файл и на экран пачками
+(файл открывается один раз, сброс на диск - раз в FLUSH_INTERVAL секунд и при закрытии).
+
+Уровни: error - только ошибки, info - начало, итоги и прогресс, debug - подробности по каждому файлу.
+Формат файла: текст "[время] (источник) сообщение" или JSON-строки (по одному объекту на запись).
+Progress - периодическая сводка о ходе обработки (файлов/с, МБ/с, оставшееся время) вместо вывода по каждому файлу.
+Сводка выводится по этапам (restart - начать новый этап со своим количеством файлов).
+"""
+
+import datetime
+import json
+import queue
+import sys
+import threading
+import time
+
+LEVELS = {'error': 40, 'info': 20, 'debug': 10}
+FLUSH_INTERVAL = 1 # секунд
+
+
+class BufferedLog:
+    """ Лог с фоновой записью.
+    path - файл лога ('' - не писать в файл);
+    level - уровень записей в файле (error, info, debug);
+    consoleLevel - уровень записей на экране;
+    jsonLines - писать в файл JSON-строки вместо текста;
+    """
+
+    def __init__(self, path, level='info', consoleLevel='info', jsonLines=False):
+        self.level = LEVELS[level]
+        self.consoleLevel = LEVELS[consoleLevel]
+        self.minLevel = min(self.level, self.consoleLevel)
+        self.jsonLines = jsonLines
+        self.file = open(path, 'a', encoding='utf-8') if path else None
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name='log', daemon=True)
+        self.thread.start()
+
+    def write(self, level, source, *text):
+        level = LEVELS[level]
+        if level < self.minLevel: # сообщение не нужно - даже не форматируем
+            return
+        self.queue.put((datetime.datetime.now(), level, source, text))
+
+    def format(self, now, level, source, text):
+        message = ' '.join(str(t) for t in text)
+        line = '[' + str(now) + '] (' + str(source) + ') ' + message
+        if self.jsonLines:
+            levelName = next(name for name, value in LEVELS.items() if value == level)
+            return line, json.dumps({'time': now.isoformat(), 'level': levelName, 'source': str(source), 'message': message}, ensure_ascii=False)
+        return line, line
+
+    def run(self):
+        lastFlush = time.monotonic()
+        stop = False
+        while not stop:
+            try:
+                records = [self.queue.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                records = []
+            while True: # забираем все, что накопилось, и пишем одной пачкой
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            console, lines = [], []
+            for record in records:
+                if record is None:
+                    stop = True
+                    continue
+                line, fileLine = self.format(*record)
+                if record[1] >= self.consoleLevel:
+                    console.append(line + '\n')
+                if record[1] >= self.level:
+                    lines.append(fileLine + '\n')
+            if console:
+                sys.stdout.write(''.join(console))
+            if self.file and lines:
+                self.file.write(''.join(lines))
+            if stop or time.monotonic() - lastFlush >= FLUSH_INTERVAL:
+                sys.stdout.flush()
+                if self.file:
+                    self.file.flush()
+                lastFlush = time.monotonic()
+
+    def close(self):
+        """ Дописываем очередь и закрываем файл """
+        self.queue.put(None)
+        self.thread.join()
+        if self.file:
+            self.file.close()
+
+
+class Progress:
+    """ Периодическая сводка о ходе обработки.
+    log - функция (source, *text), которой выводится сводка;
+    interval - период вывода, секунд;
+    totalFiles - общее количество файлов (None - неизвестно, оставшееся время не выводится);
+    phase - название этапа в сводке ('' - не выводить);
+    """
+
+    def __init__(self, log, interval=10, totalFiles=None, phase=''):
+        self.log = log
+        self.interval = interval
+        self.totalFiles = totalFiles
+        self.phase = phase
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='progress', daemon=True)
+
+    def start(self):
+        self.started = time.monotonic()
+        self.thread.start()
+        return self
+
+    def restart(self, phase, totalFiles=None):
+        """ Начинаем новый этап: счетчики и время обнуляются """
+        with self.lock:
+            self.phase, self.totalFiles = phase, totalFiles
+            self.files, self.bytes = 0, 0
+            self.started = time.monotonic()
+
+    def update(self, files=1, size=0):
+        with self.lock:
+            self.files += files
+            self.bytes += size
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def report(self):
+        with self.lock:
+            files, size, totalFiles, phase, started = self.files, self.bytes, self.totalFiles, self.phase, self.started
+        elapsed = max(time.monotonic() - started, 1e-6)
+        text = ['files:', files, 'files/s: %.1f' % (files / elapsed), 'MB/s: %.1f' % (size / elapsed / 1024 / 1024)]
+        if totalFiles:
+            text[1] = str(files) + '/' + str(totalFiles)
+            if files:
+                left = max(totalFiles - files, 0) * elapsed / files
+                text.append('ETA: ' + str(datetime.timedelta(seconds=int(left))))
+        if phase:
+            text.insert(0, phase + ':')
+        self.log('Progress', *text)
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.report()
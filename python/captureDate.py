@@ -0,0 +1,216 @@
+"""
+Дата съемки из метаданных файла.
+
+- exifDate - EXIF DateTimeOriginal (JPEG, TIFF и RAW на его основе: CR2, NEF, DNG; RAF - через встроенный JPEG);
+- mp4Date - время создания из атома mvhd (MP4, MOV).
+Читаются только заголовки: сегменты JPEG до начала изображения, нужные записи IFD, заголовки атомов MP4 -
+файл целиком не читается и не декодируется. Если даты в метаданных нет - функции возвращают None.
+
+Результаты сохраняются в кэше (DateCache) с ключом (реальный путь, размер, время изменения).
+"""
+
+import datetime
+import os
+import sqlite3
+import struct
+import time
+
+MAX_SEGMENTS = 64 # сколько сегментов JPEG / записей IFD / атомов MP4 просматриваем, не больше
+MP4_EPOCH = 2082844800 # секунд между 1904-01-01 (начало отсчета времени в MP4) и 1970-01-01
+COMMIT_INTERVAL = 5 # секунд между сохранениями кэша
+
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_DATETIME_DIGITIZED = 0x9004
+
+
+def readAt(f, offset, size):
+    f.seek(offset)
+    return f.read(size)
+
+
+def validDate(date):
+    """ Отбрасываем пустые и явно ошибочные даты (часы камеры не выставлены) """
+    if date is None or date.year < 1900 or date > datetime.datetime.now() + datetime.timedelta(days=1):
+        return None
+    return date
+
+
+def parseExifDate(value):
+    """ 'YYYY:MM:DD HH:MM:SS' -> datetime """
+    text = value.split(b'\0')[0].decode('ascii', 'ignore').strip()
+    try:
+        return validDate(datetime.datetime.strptime(text[:19], '%Y:%m:%d %H:%M:%S'))
+    except ValueError:
+        return None
+
+
+def readIfd(f, base, offset, order):
+    """ Записи IFD: тег -> (тип, количество, 4 байта значения или смещения) """
+    data = readAt(f, base + offset, 2)
+    if len(data) < 2:
+        return {}
+    count = min(struct.unpack(order + 'H', data)[0], 1000)
+    data = readAt(f, base + offset + 2, count * 12)
+    entries = {}
+    for i in range(len(data) // 12):
+        tag, kind, number = struct.unpack(order + 'HHI', data[i * 12:i * 12 + 8])
+        entries[tag] = (kind, number, data[i * 12 + 8:i * 12 + 12])
+    return entries
+
+
+def ifdText(f, base, entries, tag, order):
+    """ Строковое значение (тип ASCII) записи IFD """
+    if tag not in entries:
+        return None
+    kind, number, value = entries[tag]
+    if kind != 2:
+        return None
+    if number <= 4:
+        return value[:number]
+    return readAt(f, base + struct.unpack(order + 'I', value)[0], min(number, 64))
+
+
+def tiffDate(f, base=0):
+    """ Дата из структуры TIFF (EXIF), base - смещение заголовка TIFF в файле """
+    header = readAt(f, base, 8)
+    if header[:4] == b'II*\0':
+        order = '<'
+    elif header[:4] == b'MM\0*':
+        order = '>'
+    else:
+        return None
+    ifd0 = readIfd(f, base, struct.unpack(order + 'I', header[4:8])[0], order)
+    if TAG_EXIF_IFD in ifd0:
+        exif = readIfd(f, base, struct.unpack(order + 'I', ifd0[TAG_EXIF_IFD][2])[0], order)
+        for tag in (TAG_DATETIME_ORIGINAL, TAG_DATETIME_DIGITIZED):
+            value = ifdText(f, base, exif, tag, order)
+            if value and parseExifDate(value):
+                return parseExifDate(value)
+    value = ifdText(f, base, ifd0, TAG_DATETIME, order) # дата изменения - если даты съемки нет
+    return parseExifDate(value) if value else None
+
+
+def jpegDate(f, start=0):
+    """ Дата из сегмента APP1 (Exif) файла JPEG """
+    if readAt(f, start, 2) != b'\xff\xd8':
+        return None
+    position = start + 2
+    for _ in range(MAX_SEGMENTS):
+        header = readAt(f, position, 4)
+        if len(header) < 4 or header[0] != 0xff:
+            return None
+        marker, length = header[1], struct.unpack('>H', header[2:4])[0]
+        if marker in (0xd9, 0xda): # конец файла / начало данных изображения - EXIF дальше не бывает
+            return None
+        if marker == 0xe1 and readAt(f, position + 4, 6) == b'Exif\0\0':
+            return tiffDate(f, position + 10)
+        position += 2 + length
+    return None
+
+
+def exifDate(path):
+    """ EXIF DateTimeOriginal: JPEG, RAF (встроенный JPEG), TIFF, CR2, NEF, DNG """
+    with open(path, 'rb') as f:
+        header = f.read(92)
+        if header[:2] == b'\xff\xd8':
+            return jpegDate(f)
+        if header[:16] == b'FUJIFILMCCD-RAW ':
+            return jpegDate(f, struct.unpack('>I', header[84:88])[0])
+        return tiffDate(f)
+
+
+def findAtom(f, start, end, name):
+    """ Ищем атом MP4 среди атомов в диапазоне [start, end), возвращаем диапазон его содержимого.
+    Читаются только заголовки атомов (данные mdat пропускаются). """
+    position = start
+    for _ in range(MAX_SEGMENTS):
+        if position + 8 > end:
+            return None
+        header = readAt(f, position, 8)
+        if len(header) < 8:
+            return None
+        size, kind = struct.unpack('>I4s', header)
+        headerSize = 8
+        if size == 1: # 64-битный размер
+            size = struct.unpack('>Q', readAt(f, position + 8, 8))[0]
+            headerSize = 16
+        elif size == 0: # атом до конца файла
+            size = end - position
+        if size < headerSize:
+            return None
+        if kind == name:
+            return position + headerSize, min(position + size, end)
+        position += size
+    return None
+
+
+def mp4Date(path):
+    """ Время создания из атома moov/mvhd (MP4, MOV) """
+    with open(path, 'rb') as f:
+        moov = findAtom(f, 0, os.fstat(f.fileno()).st_size, b'moov')
+        if moov is None:
+            return None
+        mvhd = findAtom(f, moov[0], moov[1], b'mvhd')
+        if mvhd is None:
+            return None
+        data = readAt(f, mvhd[0], 12)
+        if len(data) < 8:
+            return None
+        if data[0] == 1: # версия 1 - 64-битное время
+            if len(data) < 12:
+                return None
+            created = struct.unpack('>Q', data[4:12])[0]
+        else:
+            created = struct.unpack('>I', data[4:8])[0]
+    if created <= MP4_EPOCH:
+        return None # время не записано
+    try:
+        return validDate(datetime.datetime.fromtimestamp(created - MP4_EPOCH)) # время в mvhd - UTC
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+class DateCache:
+    """ Кэш дат съемки в SQLite. Для файлов без даты в метаданных хранится NULL, чтобы не читать их повторно. """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS dates (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            date REAL)''')
+        self.db.commit()
+        self.lastCommit = time.monotonic()
+        self.realDirs = {} # директория -> ее реальный путь
+
+    def key(self, path):
+        """ Реальный путь файла: кэш находит файл, как бы ни была указана исходная папка (относительно, через ссылку).
+        os.path.realpath вызывается один раз на директорию, а не для каждого файла. """
+        directory, name = os.path.split(path)
+        realDir = self.realDirs.get(directory)
+        if realDir is None:
+            realDir = self.realDirs[directory] = os.path.realpath(directory)
+        return os.path.join(realDir, name)
+
+    def get(self, record):
+        """ (дата или None,) если файл есть в кэше и не изменился, иначе None """
+        row = self.db.execute('SELECT size, mtime, date FROM dates WHERE path = ?', (self.key(record['path']),)).fetchone()
+        if row is None or row[0] != record['size'] or row[1] != record['mtime']:
+            return None
+        return (datetime.datetime.fromtimestamp(row[2]) if row[2] is not None else None,)
+
+    def put(self, record, date):
+        self.db.execute('INSERT OR REPLACE INTO dates (path, size, mtime, date) VALUES (?, ?, ?, ?)',
+                        (self.key(record['path']), record['size'], record['mtime'], date.timestamp() if date else None))
+        if time.monotonic() - self.lastCommit >= COMMIT_INTERVAL:
+            self.db.commit()
+            self.lastCommit = time.monotonic()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,220 @@
+"""
+Копирование, перенос и создание ссылок на файлы без запуска внешних команд (cp).
+
+Способы копирования (выбирается первый доступный):
+- reflink - копия, разделяющая блоки с исходным файлом (Btrfs, XFS), мгновенно и без расхода места;
+- copy_file_range / sendfile - копирование внутри ядра, без передачи данных через память процесса;
+- обычное копирование блоками (для остальных случаев, в т.ч. других ОС).
+Режимы (mode):
+- copy - копирование, исходный файл остается на месте;
+- move - перенос (переименование в пределах одной файловой системы, иначе копирование и удаление исходного файла);
+- link - жесткая ссылка (если исходный файл и целевая папка на разных файловых системах - копирование).
+Файлы обрабатываются пулом потоков, очередь заданий ограничена - список всех файлов в памяти не накапливается.
+Перед копированием файл может проверяться на дубликаты (см. dedupIndex.py): дубликат не копируется
+или заменяется жесткой ссылкой на уже имеющуюся копию, исходный файл при этом остается на месте.
+"""
+
+import errno
+import os
+import stat
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+MODES = ('copy', 'move', 'link')
+
+FICLONE = 0x40049409 # ioctl Linux для создания reflink-копии
+BUFFER_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024 * 1024 # сколько байт передаем ядру за один вызов copy_file_range / sendfile
+
+
+def reflink(srcFd, dstFd):
+    """ Reflink-копия (только Linux, только файловые системы с поддержкой) """
+    import fcntl
+    fcntl.ioctl(dstFd, FICLONE, srcFd)
+
+
+def copyData(srcFd, dstFd, size):
+    """ Копируем содержимое открытого файла, возвращаем использованный способ """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            copied = 0
+            while copied < size:
+                sent = os.copy_file_range(srcFd, dstFd, min(CHUNK_SIZE, size - copied))
+                if sent == 0:
+                    break
+                copied += sent
+            if copied >= size:
+                return 'copy_file_range'
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+                raise
+        os.lseek(srcFd, 0, os.SEEK_SET)
+        os.lseek(dstFd, 0, os.SEEK_SET)
+        os.ftruncate(dstFd, 0)
+
+    if hasattr(os, 'sendfile'):
+        try:
+            copied = 0
+            while copied < size:
+                sent = os.sendfile(dstFd, srcFd, copied, min(CHUNK_SIZE, size - copied))
+                if sent == 0:
+                    break
+                copied += sent
+            if copied >= size:
+                return 'sendfile'
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+        os.lseek(srcFd, 0, os.SEEK_SET)
+        os.lseek(dstFd, 0, os.SEEK_SET)
+        os.ftruncate(dstFd, 0)
+
+    while True:
+        data = os.read(srcFd, BUFFER_SIZE)
+        if not data:
+            return 'buffered'
+        os.write(dstFd, data)
+
+
+def copyFile(src, dst):
+    """ Копируем файл. Целевой файл не должен существовать (FileExistsError), права доступа и время изменения сохраняются.
+    Возвращаем использованный способ копирования. """
+    srcFd = os.open(src, os.O_RDONLY)
+    try:
+        info = os.fstat(srcFd)
+        dstFd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            try:
+                reflink(srcFd, dstFd)
+                method = 'reflink'
+            except (ImportError, OSError):
+                method = copyData(srcFd, dstFd, info.st_size)
+            if hasattr(os, 'fchmod'):
+                os.fchmod(dstFd, stat.S_IMODE(info.st_mode))
+        except BaseException:
+            os.close(dstFd)
+            os.remove(dst) # недописанный файл не оставляем
+            raise
+        os.close(dstFd)
+    finally:
+        os.close(srcFd)
+    if not hasattr(os, 'fchmod'):
+        os.chmod(dst, stat.S_IMODE(info.st_mode))
+    os.utime(dst, ns=(info.st_atime_ns, info.st_mtime_ns))
+    return method
+
+
+def moveFile(src, dst):
+    """ Переносим файл. В пределах одной файловой системы - переименование, иначе копирование и удаление. """
+    if os.path.exists(dst):
+        raise FileExistsError(errno.EEXIST, 'File exists', dst)
+    try:
+        os.rename(src, dst)
+        return 'rename'
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    method = copyFile(src, dst)
+    os.remove(src)
+    return method
+
+
+def linkFile(src, dst):
+    """ Жесткая ссылка, если файлы на разных файловых системах - копирование """
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    return copyFile(src, dst)
+
+
+def transferFile(src, dst, mode='copy'):
+    """ Копируем / переносим / связываем файл в соответствии с режимом, возвращаем использованный способ """
+    if mode == 'move':
+        return moveFile(src, dst)
+    if mode == 'link':
+        return linkFile(src, dst)
+    return copyFile(src, dst)
+
+
+class CopyEngine:
+    """ Пул потоков для копирования.
+    mode - режим (copy, move, link);
+    threads - количество потоков: для одного HDD достаточно 2-4, для SSD и массивов - больше;
+    onDone - функция (src, dst, method, error, original), вызывается после обработки каждого файла (в потоке пула),
+    в т.ч. при любой ошибке копирования или индекса дубликатов (error - исключение), original - уже имеющаяся копия, если файл оказался дубликатом;
+    dedup - dedupIndex.DedupIndex для поиска дубликатов (None - не искать);
+    """
+
+    def __init__(self, mode='copy', threads=4, onDone=None, dedup=None):
+        if mode not in MODES:
+            raise ValueError('Unknown mode: ' + str(mode))
+        self.mode = mode
+        self.threads = max(1, threads)
+        self.onDone = onDone
+        self.dedup = dedup
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='copy')
+        # не больше двух заданий в очереди на поток: обход директорий не убегает вперед копирования
+        self.slots = threading.BoundedSemaphore(self.threads * 2)
+        self.lock = threading.Lock()
+        self.methods = {}
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.duplicates = 0
+
+    def submit(self, src, dst, size=0):
+        """ Ставим файл в очередь. Если очередь заполнена - ждем освобождения места. """
+        self.slots.acquire()
+        self.executor.submit(self.run, src, dst, size)
+
+    def run(self, src, dst, size):
+        method, error, original = None, None, None
+        try:
+            if self.dedup is None:
+                method = transferFile(src, dst, self.mode)
+            else:
+                method, original = self.deduplicate(src, dst, size)
+        except Exception as e: # не только OSError: например, sqlite3.Error из индекса - результат submit() никто не читает
+            error = e
+        finally:
+            self.slots.release()
+        with self.lock:
+            if error is not None:
+                self.errors += 1
+            elif original is not None:
+                self.duplicates += 1
+            else:
+                self.files += 1
+                self.bytes += size
+            if method is not None:
+                self.methods[method] = self.methods.get(method, 0) + 1
+        if self.onDone:
+            try:
+                self.onDone(src, dst, method, error, original)
+            except Exception:
+                with self.lock:
+                    self.errors += 1
+                traceback.print_exc() # иначе исключение потерялось бы в Future
+
+    def deduplicate(self, src, dst, size):
+        """ Копируем файл, если в индексе нет его копии. Возвращаем способ и путь к найденной копии (или None). """
+        with self.dedup.sizeLock(size):
+            original = self.dedup.claim(src, dst, size, os.stat(src).st_mtime)
+            if original is None:
+                try:
+                    return transferFile(src, dst, self.mode), None
+                except Exception:
+                    self.dedup.remove(dst)
+                    raise
+        if self.dedup.action == 'link':
+            os.link(original, dst)
+            return 'duplicate-link', original
+        return 'duplicate', original
+
+    def close(self):
+        """ Дожидаемся окончания всех заданий """
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,166 @@
+"""
+Поиск дубликатов по содержимому файлов.
+
+Хэши файлов целевой папки хранятся в SQLite, поэтому новые файлы сравниваются со всем, что уже было отсортировано раньше.
+Сравнение поэтапное, каждый следующий этап выполняется только для оставшихся совпадений:
+1. размер файла (без чтения файлов);
+2. хэш первых и последних QUICK_SIZE байт;
+3. хэш всего файла.
+Хэши уже отсортированных файлов вычисляются только тогда, когда они понадобились для сравнения, и сохраняются в индексе.
+Проверка вызывается из потоков копирования (см. copyEngine.py), файлы разного размера проверяются параллельно.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+ACTIONS = ('skip', 'link')
+
+QUICK_SIZE = 64 * 1024 # сколько байт с начала и с конца файла используется для быстрого хэша
+BUFFER_SIZE = 1024 * 1024
+LOCKS = 256 # файлы одного размера проверяются по очереди (иначе две одинаковые копии могут пройти проверку одновременно)
+COMMIT_INTERVAL = 5 # секунд между сохранениями индекса
+
+
+def quickHash(path, size):
+    """ Хэш начала и конца файла """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        h.update(f.read(QUICK_SIZE))
+        if size > QUICK_SIZE:
+            f.seek(max(QUICK_SIZE, size - QUICK_SIZE))
+            h.update(f.read(QUICK_SIZE))
+    return h.hexdigest()
+
+
+def fullHash(path):
+    """ Хэш всего файла """
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(BUFFER_SIZE)
+            if not data:
+                return h.hexdigest()
+            h.update(data)
+
+
+def sameContent(first, second, size):
+    """ Два файла одного размера совпадают по содержимому (сначала быстрый хэш, затем полный) """
+    if quickHash(first, size) != quickHash(second, size):
+        return False
+    return size <= QUICK_SIZE * 2 or fullHash(first) == fullHash(second)
+
+
+class DedupIndex:
+    """ Индекс хэшей файлов целевой папки.
+    path - файл базы SQLite;
+    action - что делать с дубликатом: skip - не копировать, link - создать жесткую ссылку на уже имеющуюся копию;
+    """
+
+    def __init__(self, path, action='link'):
+        if action not in ACTIONS:
+            raise ValueError('Unknown action: ' + str(action))
+        self.action = action
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS hashes (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            quick TEXT,
+            full TEXT)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS hashes_size ON hashes (size)')
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.sizeLocks = [threading.Lock() for _ in range(LOCKS)]
+        self.lastCommit = time.monotonic()
+        self.duplicates = 0
+        self.savedBytes = 0
+
+    def isEmpty(self):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM hashes LIMIT 1').fetchone() is None
+
+    def add(self, path, size, mtime, quick=None, full=None):
+        """ Добавляем файл целевой папки в индекс. Хэши можно не указывать - они будут вычислены при необходимости. """
+        self.execute('INSERT OR REPLACE INTO hashes (path, size, mtime, quick, full) VALUES (?, ?, ?, ?, ?)', (path, size, mtime, quick, full))
+
+    def remove(self, path):
+        self.execute('DELETE FROM hashes WHERE path = ?', (path,))
+
+    def execute(self, query, params):
+        with self.lock:
+            self.db.execute(query, params)
+            if time.monotonic() - self.lastCommit >= COMMIT_INTERVAL:
+                self.db.commit()
+                self.lastCommit = time.monotonic()
+
+    def candidates(self, size):
+        """ Файлы индекса того же размера, которые все еще есть на диске и не изменились """
+        with self.lock:
+            rows = self.db.execute('SELECT path, mtime, quick, full FROM hashes WHERE size = ?', (size,)).fetchall()
+        result = []
+        for path, mtime, quick, full in rows:
+            try:
+                info = os.stat(path)
+            except OSError:
+                self.remove(path) # файл удален из целевой папки
+                continue
+            if info.st_size != size:
+                self.add(path, info.st_size, info.st_mtime)
+                continue
+            if info.st_mtime != mtime:
+                # файл изменен - старые хэши недействительны
+                self.add(path, size, info.st_mtime)
+                quick, full = None, None
+            result.append([path, info.st_mtime, quick, full])
+        return result
+
+    def claim(self, src, dst, size, mtime):
+        """ Ищем копию файла src в индексе. Если копия найдена - возвращаем ее путь,
+        иначе добавляем в индекс файл dst (будущую копию src) и возвращаем None.
+        Вызывающий должен держать блокировку sizeLock(size) до окончания копирования. """
+        candidates = self.candidates(size)
+        quick, full = None, None
+        if candidates:
+            quick = quickHash(src, size)
+            if size <= QUICK_SIZE * 2:
+                full = quick # быстрый хэш уже покрывает весь файл
+            for candidate in candidates:
+                path, candidateMtime, candidateQuick, candidateFull = candidate
+                if candidateQuick is None:
+                    try:
+                        candidateQuick = quickHash(path, size)
+                    except OSError:
+                        continue
+                    if size <= QUICK_SIZE * 2:
+                        candidateFull = candidateQuick
+                    self.add(path, size, candidateMtime, candidateQuick, candidateFull)
+                if candidateQuick != quick:
+                    continue
+                if full is None:
+                    full = fullHash(src)
+                if candidateFull is None:
+                    try:
+                        candidateFull = fullHash(path)
+                    except OSError:
+                        continue
+                    self.add(path, size, candidateMtime, candidateQuick, candidateFull)
+                if candidateFull == full:
+                    with self.lock:
+                        self.duplicates += 1
+                        self.savedBytes += size
+                    return path
+        self.add(dst, size, mtime, quick, full)
+        return None
+
+    def sizeLock(self, size):
+        return self.sizeLocks[size % LOCKS]
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,77 @@
+"""
+Журнал (манифест) сортировки в SQLite: для каждого исходного файла хранится размер, время изменения и куда он был скопирован.
+
+При повторном запуске файлы, которые не изменились с прошлого раза, пропускаются - обрабатываются только новые и измененные.
+Если предыдущий запуск был прерван, файл, поставленный в очередь (status = 'queued'), копируется под тем же именем,
+а не получает новое имя с timestamp.
+"""
+
+import sqlite3
+import threading
+import time
+
+COMMIT_INTERVAL = 5 # секунд между сохранениями журнала
+COMMIT_CHANGES = 1000 # или после стольких изменений
+
+
+class Manifest:
+    """ Журнал сортировки. Можно использовать из нескольких потоков. """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS files (
+            source TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            dest TEXT,
+            status TEXT NOT NULL,
+            method TEXT,
+            error TEXT,
+            updated REAL NOT NULL)''')
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.changes = 0
+        self.lastCommit = time.monotonic()
+
+    def lookup(self, record):
+        """ Запись о файле, если он не изменился с прошлого запуска: (dest, status), иначе None """
+        with self.lock:
+            row = self.db.execute('SELECT size, mtime, dest, status FROM files WHERE source = ?', (record['path'],)).fetchone()
+        if row is None or row[0] != record['size'] or row[1] != record['mtime']:
+            return None
+        return row[2], row[3]
+
+    def markQueued(self, record, dest):
+        self.write(record['path'], record['size'], record['mtime'], dest, 'queued', None, None)
+
+    def markDone(self, record, dest, method):
+        self.write(record['path'], record['size'], record['mtime'], dest, 'done', method, None)
+
+    def markFailed(self, record, dest, error):
+        self.write(record['path'], record['size'], record['mtime'], dest, 'error', None, str(error))
+
+    def write(self, source, size, mtime, dest, status, method, error):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO files (source, size, mtime, dest, status, method, error, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (source, size, mtime, dest, status, method, error, time.time()))
+            self.changes += 1
+            # сохраняем пачками: фиксация после каждого файла замедлила бы сортировку в разы
+            if self.changes >= COMMIT_CHANGES or time.monotonic() - self.lastCommit >= COMMIT_INTERVAL:
+                self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.changes = 0
+        self.lastCommit = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.db.execute('SELECT status, COUNT(*) FROM files GROUP BY status').fetchall())
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.db.close()
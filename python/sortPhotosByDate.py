@@ -7,110 +7,464 @@
 - видео
 - неизвестные файлы (все остальное)
 Разделение по типам файлов можно настроть редактированием словаря types
-По умолчанию файлы не удаляются из исходной директории. Это можно настроить (читаем комментарии по тексту).
-Если при копировании файла в целевой директории уже есть файл с таким именем - к имени файла добавляется текущий timestamp.
+Папка год/месяц определяется по дате съемки из метаданных файла (EXIF, атом mvhd для видео, см. captureDate.py),
+функция чтения даты задается для каждого типа (date в словаре types). Если даты в метаданных нет - по времени изменения файла.
+По умолчанию файлы не удаляются из исходной директории: режим (mode) copy - копирование, move - перенос, link - жесткая ссылка.
+Копирование выполняется без запуска внешних команд, несколькими потоками (см. copyEngine.py).
+Если при копировании файла в целевой директории уже есть файл с таким именем - к имени файла добавляется текущий timestamp
+(если копии этого файла там еще нет - ни под тем же именем, ни под именем с timestamp от прошлых запусков).
+Куда скопирован каждый файл, записывается в журнал (см. sortManifest.py): при повторном запуске обрабатываются только новые
+и измененные файлы, прерванный запуск продолжается с места остановки.
+Дубликаты (файлы, содержимое которых уже есть в целевой папке) не копируются повторно (см. dedupIndex.py):
+вместо копии создается жесткая ссылка (dedup = 'link') или файл пропускается (dedup = 'skip').
 При обработке игнорируются директории, в названии которых содержится символ '@' (типа @__thumb, @eaDir и т.п.)
+Сначала строится план (куда копировать каждый файл): содержимое каждой целевой директории читается один раз,
+коллизии имен проверяются в памяти, новые директории создаются одним проходом. Затем план выполняется.
+С параметром --dry_run план только выводится (и сохраняется в файл с --plan_file), файлы не копируются.
+Запуск: python3 sortPhotosByDate.py --input <папка с фото> --output <папка для результата> [--dry_run] (все параметры - --help)
+Лог пишется в файл .sort_log.txt в папке для результата (другой файл - --log_file, без файла - --log_file "").
 
 
 """
 
-from genericpath import isfile, isdir
-import os
+import argparse
 import datetime
+import json
+import os
+import re
+import struct
 import time
 
-resultFiles = []
+import bufferedLog
+import captureDate
+import copyEngine
+import dedupIndex
+import sortManifest
 
 logFile = "/home/gofk/Документы/test_images/result.log"
+LOG_NAME = '.sort_log.txt' # имя файла лога в целевой папке при запуске из командной строки без --log_file
+logLevel = 'info' # уровень записей в файле лога: error - только ошибки, info - итоги и прогресс, debug - каждый файл
+consoleLevel = 'info' # уровень записей на экране
+logJson = False # писать лог в формате JSON-строк
+progressInterval = 10 # период вывода сводки о ходе обработки, секунд
 photoDir = "/home/gofk/Документы/test_images" # папка куда необходимо положить исходные фото для сортировки
 output_dir = "/home/gofk/Документы/result_images" # папка, где появятся отсортированные фото
+mode = 'copy' # copy - копирование, move - перенос, link - жесткая ссылка (если нельзя - копирование)
+copyThreads = 4 # количество потоков копирования: для одного HDD - 2-4, для SSD и RAID - больше
+manifestFile = os.path.join(output_dir, '.sort_manifest.sqlite') # журнал сортировки, '' - не использовать
+dedup = 'link' # дубликаты: link - жесткая ссылка на имеющуюся копию, skip - пропускать, '' - копировать как обычные файлы
+dedupFile = os.path.join(output_dir, '.sort_hashes.sqlite') # индекс хэшей файлов целевой папки
+dateCacheFile = os.path.join(output_dir, '.sort_dates.sqlite') # кэш дат съемки, '' - не использовать
+dryRun = False # только построить план и вывести итоги, ничего не копировать
+planOutput = '' # файл для сохранения плана (JSON-строки: действие, исходный файл, целевой файл), '' - не сохранять
 
-# список типов (редактируем по необходимости), base folder - папка, в которую будут помещаться файлы этого типа
+# список типов (редактируем по необходимости), base folder - папка, в которую будут помещаться файлы этого типа,
+# date - функция чтения даты съемки из файла (нет - используется время изменения файла)
 types = {}
-types['jpg'] = {'base_folder': 'images_by_date'}
-types['jpeg'] = {'base_folder': 'images_by_date'}
+types['jpg'] = {'base_folder': 'images_by_date', 'date': captureDate.exifDate}
+types['jpeg'] = {'base_folder': 'images_by_date', 'date': captureDate.exifDate}
 types['bmp'] = {'base_folder': 'images_by_date'}
 types['png'] = {'base_folder': 'images_by_date'}
-types['raf'] = {'base_folder': 'raw_by_date'}
-types['raw'] = {'base_folder': 'raw_by_date'}
-types['cr2'] = {'base_folder': 'raw_by_date'}
-types['nef'] = {'base_folder': 'raw_by_date'}
+types['raf'] = {'base_folder': 'raw_by_date', 'date': captureDate.exifDate}
+types['raw'] = {'base_folder': 'raw_by_date', 'date': captureDate.exifDate}
+types['cr2'] = {'base_folder': 'raw_by_date', 'date': captureDate.exifDate}
+types['nef'] = {'base_folder': 'raw_by_date', 'date': captureDate.exifDate}
 types['psd'] = {'base_folder': 'raw_by_date'}
-types['dng'] = {'base_folder': 'raw_by_date'}
-types['mov'] = {'base_folder': 'video_by_date'}
-types['mp4'] = {'base_folder': 'video_by_date'}
+types['dng'] = {'base_folder': 'raw_by_date', 'date': captureDate.exifDate}
+types['mov'] = {'base_folder': 'video_by_date', 'date': captureDate.mp4Date}
+types['mp4'] = {'base_folder': 'video_by_date', 'date': captureDate.mp4Date}
 
 
 count = 0
+skipped = 0 # файлы, уже отсортированные предыдущими запусками
+engine = None # copyEngine.CopyEngine, создается в getFiles
+manifest = None # sortManifest.Manifest, создается в getFiles
+hashIndex = None # dedupIndex.DedupIndex, создается в getFiles
+dateCache = None # captureDate.DateCache, создается в getFiles
+log = None # bufferedLog.BufferedLog, создается в getFiles
+progress = None # bufferedLog.Progress, создается в getFiles
+reservedNames = {} # целевые файлы из плана, возможно, еще не созданные -> запись об исходном файле
+dirListing = {} # целевая директория -> имена файлов в ней (уже существующих и из плана)
+renamedFiles = {} # целевая директория -> исходное имя -> имена файлов, переименованных при коллизии имен
+RENAMED = re.compile(r'(.+)_\d{10}(?:_\d+)?(\.[^.]*)?$') # имя с добавленным timestamp: IMG_1_1700000000.jpg, IMG_1_1700000000_2.jpg
+newDirs = set() # целевые директории, которых еще нет - создаются одним проходом перед копированием
+
+def toLog(deviceName, *text, level='info'):
+    """ Используем вместо print: пишем в лог (см. bufferedLog.py), level - error, info или debug (подробности по каждому файлу) """
+    if log is not None:
+        log.write(level, deviceName, *text)
+    elif bufferedLog.LEVELS[level] >= bufferedLog.LEVELS['info']: # лог еще не открыт
+        print('[' + str(datetime.datetime.now()) + '] (' + str(deviceName) + ') ' + ' '.join(str(t) for t in text))
+
+
+def walkFiles(directory):
+    """ Обходим дерево каталогов (генератор), возвращаем DirEntry каждого файла.
+    Используем os.scandir: тип файла известен без отдельного вызова stat, результат stat кэшируется в DirEntry.
+    Игнорируемые директории (в названии есть '@') отбрасываются до захода в них.
+    Символические ссылки на файлы обрабатываются как сами файлы, ссылки на директории не обходятся (защита от циклов).
+    Обход без рекурсии и без накопления списка файлов - память не растет даже на архивах из миллионов файлов. """
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                subdirs = []
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if "@" not in entry.name: # служебные директории NAS (@eaDir, @__thumb и т.п.) не обходим
+                            subdirs.append(entry.path)
+                    elif entry.is_file(): # по ссылке - как os.path.isfile
+                        yield entry
+        except OSError as e:
+            toLog('Directory', 'Read error', current, e, level='error')
+            continue
+        # в стек в обратном порядке, чтобы директории обходились в порядке чтения
+        stack.extend(reversed(subdirs))
+
+
+def fileRecords(directory):
+    """ Поток записей о файлах для сортировки: путь, имя, расширение, размер, время изменения.
+    Пути строятся от реального пути директории - журнал и кэши находят файл, как бы ни была указана папка (относительно, через ссылку). """
+    for entry in walkFiles(os.path.realpath(directory)):
+        try:
+            info = entry.stat() # для ссылки - размер и время изменения самого файла
+        except OSError as e:
+            toLog('File', 'Stat error', entry.path, e, level='error')
+            continue
+        yield {
+            'path': entry.path,
+            'name': entry.name,
+            'ext': os.path.splitext(entry.name)[-1][1:].lower(),
+            'size': info.st_size,
+            'mtime': info.st_mtime,
+        }
+
+
+def sameFile(record, fileName):
+    """ Целевой файл - полная копия исходного: совпадают размер, время изменения (копирование их сохраняет) и содержимое """
+    try:
+        info = os.stat(fileName)
+        if info.st_size != record['size'] or info.st_mtime != record['mtime']:
+            return False
+        if os.path.samefile(record['path'], fileName): # жесткая ссылка (режим link)
+            return True
+        # другой файл с тем же именем, размером и временем изменения - не копия
+        return dedupIndex.sameContent(record['path'], fileName, record['size'])
+    except OSError:
+        return False
+
+
+def fileDate(record):
+    """ Дата съемки (из метаданных, если для типа файла задана функция чтения даты), иначе время изменения файла """
+    readDate = types.get(record['ext'], {}).get('date')
+    if readDate is not None:
+        cached = dateCache.get(record) if dateCache else None
+        if cached is not None:
+            date = cached[0]
+        else:
+            try:
+                date = readDate(record['path'])
+            except (OSError, ValueError, struct.error) as e:
+                toLog(count, 'Date read error', record['path'], e, level='error')
+                date = None
+            if dateCache:
+                dateCache.put(record, date)
+        if date is not None:
+            return date
+    return datetime.datetime.fromtimestamp(int(record['mtime']))
+
+
+def listDir(resultDir):
+    """ Имена файлов целевой директории: читаем один раз, дальше коллизии имен проверяются в памяти """
+    names = dirListing.get(resultDir)
+    if names is None:
+        try:
+            names = set(os.listdir(resultDir))
+        except FileNotFoundError: # целевая директория еще не создана - создадим перед копированием
+            names = set()
+            newDirs.add(resultDir)
+        dirListing[resultDir] = names
+    return names
 
-def toLog(deviceName, *text):
-    """ Используем вместо print, печатаем на экран и пишем в лог """
-    now = datetime.datetime.now()
-    record = "[" + str(now) + "] (" + str(deviceName) + ") "
-    if len(text)>1:
-        for t in text:
-            record += str(t) + " "
+
+def renamedCopies(resultDir, names, name):
+    """ Имена файлов целевой директории, получивших timestamp при коллизии с именем name """
+    renamed = renamedFiles.get(resultDir)
+    if renamed is None: # разбираем имена директории один раз
+        renamed = renamedFiles[resultDir] = {}
+        for existing in names:
+            match = RENAMED.match(existing)
+            if match:
+                renamed.setdefault(match.group(1) + (match.group(2) or ''), []).append(existing)
+    return renamed.get(name, [])
+
+
+def sortedCopy(record, resultDir, names):
+    """ Копия файла, уже лежащая в целевой директории под тем же именем или под именем с timestamp (после коллизии имен), иначе None """
+    for name in [record['name']] + renamedCopies(resultDir, names, record['name']):
+        fileName = os.path.join(resultDir, name)
+        if fileName not in reservedNames and sameFile(record, fileName):
+            return fileName
+    return None
+
+
+def planFile(record):
+    """ Определяем, куда копировать файл. Возвращаем (действие, запись о файле, целевой файл) или None, если файл уже отсортирован.
+    Действия: copy - копировать, rename - копировать под другим именем (имя занято), resume - повторить копирование прерванного запуска,
+    existing - такой же файл уже есть в целевой папке (только записать в журнал). """
+    global count, skipped
+
+    previous = manifest.lookup(record) if manifest else None
+    if previous is not None:
+        previousFile, status = previous
+        if status == 'done' or (status == 'queued' and sameFile(record, previousFile)):
+            # файл не изменился и уже скопирован (в т.ч. прерванным запуском, не успевшим это записать)
+            if status != 'done' and not dryRun:
+                manifest.markDone(record, previousFile, 'resumed')
+            skipped += 1
+            progress.update()
+            return None
+
+    count += 1
+    currentFile = record['path']
+    name = record['name']
+    ext = record['ext']
+
+    date = fileDate(record)
+    year = str(date.year)
+    month = str(date.month)
+
+    if ext in types:
+        folder = types[ext]['base_folder']
+        resultDir = os.path.join(output_dir, folder, year, month) # раскладываем в структуру "год/месяц"
     else:
-        record += str(text[0])
-    print(record)
-    record += '\n'
-    f = open(logFile, 'a+')
-    f.write(record)
-    f.close()
+        folder = 'unknown'
+        resultDir = os.path.join(output_dir, folder, year) # неизвестные файлы раскладываем только по годам
 
+    toLog(count, 'File', currentFile, level='debug')
+    toLog(count, 'Result directory', resultDir, level='debug')
+    names = listDir(resultDir)
 
-def getFiles(directory):
-    global filesList
-    global count
+    action = 'copy'
+    resultFileName = os.path.join(resultDir, name)
+    if previous is not None and previous[1] == 'queued' and os.path.dirname(previous[0]) == resultDir and previous[0] not in reservedNames:
+        # прерванный запуск: продолжаем под тем же именем
+        resultFileName = previous[0]
+        action = 'resume'
+    elif name in names:
+        existingFile = sortedCopy(record, resultDir, names)
+        if existingFile is not None:
+            # файл уже есть в целевой папке (скопирован без журнала) - не делаем еще одну копию с timestamp
+            toLog(count, 'Already sorted', currentFile, '->', existingFile, level='debug')
+            count -= 1
+            skipped += 1
+            return 'existing', record, existingFile
+        # если файл с таким именем уже есть - добавляем к имени текущий timestamp
+        now = str(int(time.time()))
+        base, extension = os.path.splitext(name)
+        name = base + '_' + now + extension
+        suffix = 1
+        while name in names:
+            name = base + '_' + now + '_' + str(suffix) + extension
+            suffix += 1
+        resultFileName = os.path.join(resultDir, name)
+        action = 'rename'
+        toLog(count, 'Rename file. New filename', name, level='debug')
+    toLog(count, 'Result file', resultFileName, level='debug')
+
+    names.add(os.path.basename(resultFileName))
+    reservedNames[resultFileName] = record
+    return action, record, resultFileName
+
+
+def buildPlan(records):
+    """ План сортировки: список (действие, запись о файле, целевой файл) для всех файлов, которые нужно обработать.
+    План хранится в памяти целиком (около 1 КБ на файл). """
+    plan = []
+    actions = {}
+    size = 0
+    for record in records:
+        entry = planFile(record)
+        if entry is None:
+            continue
+        plan.append(entry)
+        progress.update()
+        actions[entry[0]] = actions.get(entry[0], 0) + 1
+        if entry[0] != 'existing':
+            size += record['size']
+        if dryRun:
+            toLog('Plan', entry[0], entry[1]['path'], '->', entry[2], level='debug')
+    toLog('Plan', 'Files:', len(plan) - actions.get('existing', 0), 'bytes:', size, 'already sorted:', skipped,
+          'new directories:', len(newDirs), 'actions:', actions)
+    return plan
 
+
+def writePlan(plan, path):
+    """ Сохраняем план в файл (JSON-строки) """
+    with open(path, 'w', encoding='utf-8') as f:
+        for action, record, resultFileName in plan:
+            f.write(json.dumps({'action': action, 'source': record['path'], 'result': resultFileName, 'size': record['size']}, ensure_ascii=False) + '\n')
+    toLog('Plan', 'Saved to', path)
+
+
+def makeDirs():
+    """ Создаем все новые целевые директории одним проходом """
+    for directory in sorted(newDirs):
+        os.makedirs(directory, exist_ok=True)
+    toLog('Plan', 'Created directories:', len(newDirs))
+    newDirs.clear()
+
+
+def executePlan(plan):
+    """ Выполняем план и дожидаемся окончания копирования """
+    progress.restart('copy', len(plan)) # количество файлов известно из плана - выводится оставшееся время
+    for action, record, resultFileName in plan:
+        if action == 'existing':
+            reservedNames.pop(resultFileName, None)
+            progress.update()
+            if manifest:
+                manifest.markDone(record, resultFileName, 'existing')
+            continue
+        if action == 'resume' and os.path.exists(resultFileName):
+            toLog('Plan', 'Remove incomplete file', resultFileName, level='debug')
+            os.remove(resultFileName) # недописанный файл прерванного запуска
+        if manifest:
+            manifest.markQueued(record, resultFileName)
+        engine.submit(record['path'], resultFileName, record['size'])
+    engine.close()
+
+
+def fileDone(src, dst, method, error, original=None):
+    """ Вызывается потоком копирования после обработки файла """
+    record = reservedNames.pop(dst, None)
+    progress.update(1, record['size'] if record and error is None and original is None else 0)
+    if original is not None:
+        toLog('Duplicate', src, '=', original, '->', dst if method == 'duplicate-link' else 'skipped', level='debug')
+        if manifest and record:
+            manifest.markDone(record, dst if method == 'duplicate-link' else original, method)
+    elif error is None:
+        toLog('Done', mode, method, src, '->', dst, level='debug')
+        if manifest and record:
+            manifest.markDone(record, dst, method)
+    else:
+        toLog('Error', mode, src, '->', dst, error, level='error')
+        if manifest and record:
+            manifest.markFailed(record, dst, error)
+
+
+def startSort(directory):
+    """ Открываем лог, журнал, кэши и пул копирования """
+    global engine, manifest, hashIndex, dateCache, log, progress
+
+    if logFile:
+        os.makedirs(os.path.dirname(logFile) or '.', exist_ok=True)
+    log = bufferedLog.BufferedLog(logFile, logLevel, consoleLevel, logJson)
     toLog('Directory', directory)
-    for root, dirs, files in os.walk(directory):
-
-        for dir in dirs:
-            if dir not in ('.', '..'):
-                getFiles(dir)        
-
-        for name in files:
-            currentFile = os.path.join(root, name)
-            count += 1
-            if isfile(currentFile) and "@" not in root:
-                info = os.stat(currentFile)
-                ext = os.path.splitext(name)[-1][1:]                
-
-                # копируем файл в папку по датам
-
-                date = datetime.datetime.fromtimestamp(int(info.st_mtime))
-                year = str(date.year)
-                month = str(date.month)
-
-                if ext.lower() in types:
-                    folder = types[ext.lower()]['base_folder']
-                    resultDir = os.path.join(output_dir, folder, year, month) # раскладываем в структуру "год/месяц"
-                else:
-                    folder = 'unknown'
-                    resultDir = os.path.join(output_dir, folder, year) # неизвестные файлы раскладываем только по годам
-
-                toLog(count, 'File', currentFile)
-                toLog(count, 'Result directory', resultDir)
-                if not os.path.isdir(resultDir): # целевая директория еще не создана
-                    toLog(count, 'Create result directory', resultDir)
-                    os.makedirs(resultDir)
-                
-                resultFileName = os.path.join(resultDir, name)
-                toLog(count, 'Result file', resultFileName)
-                if os.path.exists(resultFileName): # если файл с таким именем уже есть - добавляем к имени текущий timestamp
-                    now = str(int(time.time()))
-                    name = os.path.splitext(name)[0] + '_' + now + '.' + ext
-                    toLog(count, 'Rename file. New filename', name)
-
-                # Перенос файла
-                # os.replace(currentFile, resultFileName)
-                # toLog(count, 'File moved', resultFileName)
-
-                # Копирование файла
-                cmd = 'cp "' + currentFile + '" "' + resultFileName + '"'
-                toLog(count, cmd)
-                os.system(cmd)
-                toLog(count, 'File copied', resultFileName)
-
-getFiles(photoDir)
+    progress = bufferedLog.Progress(toLog, progressInterval, phase='plan')
+    # в режиме dryRun в целевой папке ничего не создаем: журнал и кэш только читаем, если они есть
+    if manifestFile and (not dryRun or os.path.exists(manifestFile)):
+        os.makedirs(os.path.dirname(manifestFile) or '.', exist_ok=True)
+        manifest = sortManifest.Manifest(manifestFile)
+    if dateCacheFile and (not dryRun or os.path.exists(dateCacheFile)):
+        os.makedirs(os.path.dirname(dateCacheFile) or '.', exist_ok=True)
+        dateCache = captureDate.DateCache(dateCacheFile)
+    if dedup and not dryRun: # дубликаты ищутся при копировании
+        os.makedirs(os.path.dirname(dedupFile) or '.', exist_ok=True)
+        hashIndex = dedupIndex.DedupIndex(dedupFile, dedup)
+        if hashIndex.isEmpty():
+            indexOutputDir()
+    engine = copyEngine.CopyEngine(mode, copyThreads, fileDone, hashIndex)
+    progress.start()
+
+
+def finishSort():
+    """ Дожидаемся копирования, закрываем журнал, кэши и лог """
+    global engine, manifest, hashIndex, dateCache, log, progress, count, skipped
+
+    engine.close()
+    for resource in (manifest, hashIndex, dateCache):
+        if resource:
+            resource.close()
+    progress.stop()
+    toLog('Directory', 'Files:', engine.files, 'bytes:', engine.bytes, 'errors:', engine.errors, 'skipped:', skipped,
+          'duplicates:', engine.duplicates, 'methods:', engine.methods)
+    log.close()
+    engine, manifest, hashIndex, dateCache, log, progress = None, None, None, None, None, None
+    count, skipped = 0, 0
+    dirListing.clear()
+    renamedFiles.clear()
+    newDirs.clear()
+    reservedNames.clear()
+
+
+def getFiles(directory):
+    """ Сортируем все файлы директории: строим план (куда копировать каждый файл), создаем директории, выполняем план """
+    startSort(directory)
+    try:
+        plan = buildPlan(fileRecords(directory))
+        if planOutput:
+            writePlan(plan, planOutput)
+        if not dryRun:
+            makeDirs()
+            executePlan(plan)
+    finally:
+        finishSort()
+
+
+def indexOutputDir():
+    """ Первый запуск с поиском дубликатов: добавляем в индекс файлы, которые уже есть в целевой папке (только размер - хэши вычисляются при необходимости) """
+    if not os.path.isdir(output_dir):
+        return
+    toLog('Dedup', 'Index', output_dir)
+    indexed = 0
+    for record in fileRecords(output_dir):
+        if record['name'].startswith('.sort_'): # журнал и индекс
+            continue
+        hashIndex.add(record['path'], record['size'], record['mtime'])
+        indexed += 1
+    toLog('Dedup', 'Indexed files:', indexed)
+
+
+def main(argv=None):
+    """ Параметры командной строки (по умолчанию - значения из начала скрипта) """
+    global photoDir, output_dir, logFile, mode, copyThreads, dedup, manifestFile, dedupFile, dateCacheFile
+    global logLevel, consoleLevel, logJson, progressInterval, dryRun, planOutput
+
+    parser = argparse.ArgumentParser(description='Раскладываем файлы (фото, видео) по папкам год/месяц')
+    parser.add_argument('--input', type=str, required=True, help='Папка с исходными файлами')
+    parser.add_argument('--output', type=str, required=True, help='Папка, где появятся отсортированные файлы')
+    parser.add_argument('--log_file', type=str, default=None,
+                        help='Файл лога, по умолчанию - ' + LOG_NAME + ' в папке --output (с --dry_run - только на экран), "" - не писать в файл')
+    parser.add_argument('--mode', type=str, default=mode, choices=copyEngine.MODES, help='copy - копирование, move - перенос, link - жесткая ссылка')
+    parser.add_argument('--threads', type=int, default=copyThreads, help='Количество потоков копирования')
+    parser.add_argument('--dedup', type=str, default=dedup or 'none', choices=dedupIndex.ACTIONS + ('none',), help='Дубликаты: link - жесткая ссылка, skip - пропускать, none - не искать')
+    parser.add_argument('--no_manifest', action='store_true', help='Не использовать журнал (обрабатывать все файлы)')
+    parser.add_argument('--log_level', type=str, default=logLevel, choices=tuple(bufferedLog.LEVELS), help='Уровень записей в файле лога')
+    parser.add_argument('--console_level', type=str, default=consoleLevel, choices=tuple(bufferedLog.LEVELS), help='Уровень записей на экране')
+    parser.add_argument('--log_json', action='store_true', default=logJson, help='Лог в формате JSON-строк')
+    parser.add_argument('--progress_interval', type=float, default=progressInterval, help='Период вывода сводки о ходе обработки, секунд')
+    parser.add_argument('--dry_run', action='store_true', help='Только построить план и вывести итоги, ничего не копировать')
+    parser.add_argument('--plan_file', type=str, default=planOutput, help='Сохранить план в файл (JSON-строки)')
+    args = parser.parse_args(argv)
+    # в индексе дубликатов и журнале хранятся полные пути: повторный запуск из другой папки находит те же файлы
+    args.input, args.output = os.path.realpath(args.input), os.path.realpath(args.output)
+
+    if args.output != output_dir: # журнал и кэши лежат в целевой папке
+        manifestFile = os.path.join(args.output, os.path.basename(manifestFile)) if manifestFile else ''
+        dedupFile = os.path.join(args.output, os.path.basename(dedupFile))
+        dateCacheFile = os.path.join(args.output, os.path.basename(dateCacheFile)) if dateCacheFile else ''
+    photoDir, output_dir, mode, copyThreads = args.input, args.output, args.mode, args.threads
+    if args.log_file is not None:
+        logFile = args.log_file
+    else: # dry run ничего не создает в целевой папке
+        logFile = '' if args.dry_run else os.path.join(output_dir, LOG_NAME)
+    dedup = '' if args.dedup == 'none' else args.dedup
+    if args.no_manifest:
+        manifestFile = ''
+    logLevel, consoleLevel, logJson, progressInterval = args.log_level, args.console_level, args.log_json, args.progress_interval
+    dryRun, planOutput = args.dry_run, args.plan_file
+    getFiles(photoDir)
+
+
+if __name__ == "__main__":
+    main()